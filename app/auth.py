@@ -1,15 +1,91 @@
 from passlib.context import CryptContext
+from passlib.hash import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from jose import jwt
+from fastapi import Depends, Header, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from sqlalchemy.orm import Session
+import asyncio
+import math
 import os
 import random
+import secrets
 import string
+import time
+
+from app.database import get_db
+from app.models import User
+from app.utils import metrics
+from app.utils.ttl_cache import TTLCache
 
 SECRET_KEY = os.getenv("SECRET_KEY", "dev_secret")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_HOURS = 12
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+# shared secret for operator-only endpoints and headers; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+MIN_BCRYPT_ROUNDS = 10
+MAX_BCRYPT_ROUNDS = 15
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+HASH_QUEUE_DEPTH = metrics.Gauge(
+    "scalp_password_hash_queue_depth",
+    "Password hash/verify jobs waiting or running on the bcrypt executor",
+)
+HASH_SECONDS = metrics.Histogram(
+    "scalp_password_hash_seconds",
+    "Time spent in bcrypt per operation",
+    ("op",),
+)
+HASH_WAIT_SECONDS = metrics.Histogram(
+    "scalp_password_hash_wait_seconds",
+    "Time a bcrypt job waited for a free worker",
+)
+HASH_REJECTED = metrics.Counter(
+    "scalp_password_hash_rejected_total",
+    "bcrypt jobs refused because the queue was full",
+)
+
+
+def calibrate_bcrypt_rounds(target_ms: float) -> int:
+    # each extra round doubles the cost, so time a cheap hash and extrapolate
+    started = time.perf_counter()
+    bcrypt.using(rounds=8).hash("calibration")
+    base_ms = (time.perf_counter() - started) * 1000
+    rounds = 8 + round(math.log2(max(target_ms, 1) / max(base_ms, 0.01)))
+    return min(max(rounds, MIN_BCRYPT_ROUNDS), MAX_BCRYPT_ROUNDS)
+
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def _configured_rounds() -> int:
+    if os.getenv("BCRYPT_ROUNDS"):
+        return int(os.getenv("BCRYPT_ROUNDS"))
+    if os.getenv("BCRYPT_TARGET_MS"):
+        return calibrate_bcrypt_rounds(float(os.getenv("BCRYPT_TARGET_MS")))
+    return 12
+
+
+BCRYPT_ROUNDS = _configured_rounds()
+
+# min_rounds makes needs_update() flag hashes weaker than the current cost
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+# bcrypt gets its own small pool so a login burst cannot take over
+# Starlette's shared threadpool
+_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="bcrypt"
+)
 
 
 def hash_password(password: str) -> str:
@@ -20,6 +96,45 @@ def verify_password(password: str, hashed_password: str) -> bool:
     return pwd_context.verify(password, hashed_password)
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+
+async def _run_hashing(op, fn, *args):
+    if HASH_QUEUE_DEPTH.value() >= PASSWORD_HASH_MAX_QUEUE:
+        HASH_REJECTED.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Server sedang sibuk, silakan coba lagi",
+            headers={"Retry-After": "1"}
+        )
+
+    submitted = time.perf_counter()
+
+    def job():
+        started = time.perf_counter()
+        HASH_WAIT_SECONDS.observe(started - submitted)
+        try:
+            return fn(*args)
+        finally:
+            HASH_SECONDS.observe(time.perf_counter() - started, op=op)
+
+    HASH_QUEUE_DEPTH.inc()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, job)
+    finally:
+        HASH_QUEUE_DEPTH.dec()
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hashing("hash", hash_password, password)
+
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await _run_hashing("verify", verify_password, password, hashed_password)
+
+
 def create_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
@@ -29,3 +144,99 @@ def create_token(data: dict) -> str:
 
 def generate_reset_code() -> str:
     return "".join(random.choices(string.digits, k=6))
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    id: int
+    username: str
+    email: str
+    full_name: str
+    gender: str
+
+
+AUTH_CACHE = metrics.Counter(
+    "scalp_auth_cache_requests_total",
+    "Token-claims and user-row cache lookups",
+    ("cache", "result"),
+)
+
+# verified claims live until the token's own exp; user rows only briefly so
+# profile changes and deletions are picked up quickly
+_claims_cache = TTLCache(TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_HOURS * 3600)
+_user_cache = TTLCache(USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+_bearer = HTTPBearer(auto_error=False)
+
+_unauthorized = HTTPException(
+    status_code=401,
+    detail="Token tidak valid atau kadaluarsa",
+    headers={"WWW-Authenticate": "Bearer"}
+)
+
+
+def decode_token(token: str) -> dict:
+    claims = _claims_cache.get(token)
+    if claims is not None:
+        AUTH_CACHE.inc(cache="claims", result="hit")
+        return claims
+    AUTH_CACHE.inc(cache="claims", result="miss")
+
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise _unauthorized
+    if "user_id" not in claims or "exp" not in claims:
+        raise _unauthorized
+
+    _claims_cache.set(token, claims, expires_at=float(claims["exp"]))
+    return claims
+
+
+def load_user(db: Session, user_id: int) -> CurrentUser | None:
+    user = _user_cache.get(user_id)
+    if user is not None:
+        AUTH_CACHE.inc(cache="user", result="hit")
+        return user
+    AUTH_CACHE.inc(cache="user", result="miss")
+
+    row = db.query(User).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    user = CurrentUser(row.id, row.username, row.email, row.full_name, row.gender)
+    _user_cache.set(user_id, user)
+    return user
+
+
+def forget_user(user_id: int):
+    _user_cache.pop(user_id)
+
+
+def get_optional_user(
+    credentials: HTTPAuthorizationCredentials | None = Depends(_bearer),
+    db: Session = Depends(get_db),
+) -> CurrentUser | None:
+    if credentials is None:
+        return None
+    claims = decode_token(credentials.credentials)
+    user = load_user(db, claims["user_id"])
+    if user is None:
+        raise _unauthorized
+    return user
+
+
+def get_current_user(user: CurrentUser | None = Depends(get_optional_user)) -> CurrentUser:
+    """Resolve the bearer token to a user; cached, so usually no DB query."""
+    if user is None:
+        raise _unauthorized
+    return user
+
+
+def is_admin_token(token: str | None) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    """Guard for operator endpoints: ``X-Admin-Token`` must match ``ADMIN_TOKEN``."""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Akses ditolak")
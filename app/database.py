@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
@@ -8,14 +8,63 @@ if not DATABASE_URL:
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, '..', 'app.db')}"
 
-connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+# applied to every new SQLite connection; WAL lets readers run alongside the
+# single writer, and NORMAL sync is durable in WAL mode except on power loss
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    # negative means KiB rather than pages
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args=connect_args
-)
+# connection pool for server databases (Postgres, MySQL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+
+
+def _apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def make_engine(url: str = DATABASE_URL, sqlite_pragmas: dict | None = None):
+    """Engine with the SQLite pragmas or the pool settings for ``url``.
+
+    ``sqlite_pragmas`` defaults to ``SQLITE_PRAGMAS``; pass ``{}`` for
+    SQLite's own defaults.
+    """
+    if not url.startswith("sqlite"):
+        return create_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+
+    pragmas = dict(SQLITE_PRAGMAS if sqlite_pragmas is None else sqlite_pragmas)
+    if ":memory:" in url or url.rstrip("/") == "sqlite:":
+        # an in-memory database has no journal file to switch
+        pragmas.pop("journal_mode", None)
+
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    if pragmas:
+        event.listen(engine, "connect", lambda conn, _: _apply_pragmas(conn, pragmas))
+    return engine
+
+
+engine = make_engine()
 
 SessionLocal = sessionmaker(
     bind=engine,
@@ -1,33 +1,75 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
-from app.routes import predict_routes, auth_routes
-from app.database import Base, engine
-from app import models
+from app.ml import hair_classification
+from app.routes import predict_routes, auth_routes, history_routes, admin_routes
+from app.migrations import run_migrations
+from app.utils import metrics
+from app.utils.admission import AdmissionMiddleware
+from app.utils.email import sender as email_sender
+from app.utils.history_recorder import recorder as history_recorder
+from app.utils.ingest import UploadLimitMiddleware
+from app.utils.maintenance import purger as reset_purger
+from app.utils.profiling import ProfilingMiddleware
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if email_sender is not None:
+        email_sender.start()
+    if reset_purger is not None:
+        reset_purger.start()
+    # load in the background so the worker starts serving (and /ready can
+    # say "not yet") while the interpreters are built and warmed up
+    loader = asyncio.create_task(asyncio.to_thread(hair_classification.load_model))
+    loader.add_done_callback(lambda t: t.cancelled() or t.exception())
+    yield
+    # drain buffered History rows while the embedding index is still open
+    if history_recorder is not None:
+        history_recorder.close()
+    hair_classification.unload_model()
+    if email_sender is not None:
+        email_sender.close()
+    if reset_purger is not None:
+        reset_purger.close()
+
+
 app = FastAPI(
     title="Scalp Analysis API",
     description="API untuk analisis kondisi kulit kepala berbasis GANs dan CNN VGG16",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
-Base.metadata.create_all(bind=engine)
+run_migrations()
 
 
 if not os.path.exists("static"):
     os.makedirs("static/uploads", exist_ok=True)
     os.makedirs("static/healthy", exist_ok=True)
 
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+# outermost, so a profile covers the whole request
+app.add_middleware(ProfilingMiddleware)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
 app.include_router(auth_routes.router)
 app.include_router(predict_routes.router)
+app.include_router(history_routes.router)
+app.include_router(admin_routes.router)
 
 
 @app.get("/")
@@ -37,3 +79,25 @@ def root():
         "message": "Backend running",
         "docs": "/docs"
     }
+
+
+@app.get("/ready")
+def ready():
+    if not hair_classification.is_ready():
+        status = "error" if hair_classification.load_error else "loading"
+        return JSONResponse(
+            {"status": status, "detail": hair_classification.load_error},
+            status_code=503
+        )
+    return {
+        "status": "ready",
+        "model_version": hair_classification.MODEL_VERSION,
+        "runtime": hair_classification.runtime,
+        "variant": hair_classification.variant.metadata(),
+        "load_seconds": round(hair_classification.load_seconds, 3)
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return metrics.render()
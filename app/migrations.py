@@ -0,0 +1,70 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, engine
+from app import models  # noqa: F401  (registers the tables on Base)
+from app.utils.summaries import rebuild
+
+logger = logging.getLogger(__name__)
+
+
+def _add_column(bind, table, column):
+    if not column.nullable:
+        raise RuntimeError(f"cannot add NOT NULL column {table.name}.{column.name} to existing rows")
+    dialect = bind.dialect
+    with bind.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE {dialect.identifier_preparer.format_table(table)} "
+            f"ADD COLUMN {dialect.identifier_preparer.format_column(column)} "
+            f"{column.type.compile(dialect=dialect)}"
+        ))
+
+
+def run_migrations(bind=engine):
+    """Bring an existing database up to date with the models.
+
+    ``create_all`` only creates missing tables, so nullable columns and
+    indexes added to a table that already exists are created here, and a
+    summary table that is new to this database is filled from
+    ``histories``. Safe to run on every start-up, including by several
+    workers at once: a column or index another worker added in the
+    meantime is not an error.
+    """
+    had_summaries = inspect(bind).has_table(models.DiagnosisSummary.__tablename__)
+    Base.metadata.create_all(bind=bind)
+
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                try:
+                    _add_column(bind, table, column)
+                except DBAPIError:
+                    if column.name not in {c["name"] for c in inspect(bind).get_columns(table.name)}:
+                        raise
+                    continue
+                logger.info("added column %s to %s", column.name, table.name)
+
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                try:
+                    index.create(bind, checkfirst=True)
+                except DBAPIError:
+                    if index.name not in {ix["name"] for ix in inspect(bind).get_indexes(table.name)}:
+                        raise
+                    continue
+                logger.info("created index %s on %s", index.name, table.name)
+
+    if not had_summaries:
+        rows = rebuild(sessionmaker(bind=bind, autoflush=False))
+        logger.info("built diagnosis summaries from %d history row(s)", rows)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    run_migrations()
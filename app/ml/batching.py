@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from app.ml.registry import split_outputs
+from app.utils import metrics, profiling
+
+BATCH_SIZE = metrics.Histogram(
+    "scalp_inference_batch_size",
+    "Number of images per interpreter invoke()",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+QUEUE_WAIT = metrics.Histogram(
+    "scalp_inference_queue_wait_seconds",
+    "Time a request waits in the batch queue before invoke()",
+)
+INVOKE_SECONDS = metrics.Histogram(
+    "scalp_inference_invoke_seconds",
+    "Duration of one batched invoke()",
+)
+QUEUE_DEPTH = metrics.Gauge(
+    "scalp_inference_queue_depth",
+    "Requests waiting in the batch queue",
+)
+BUSY_WORKERS = metrics.Gauge(
+    "scalp_inference_workers_busy",
+    "Interpreter workers currently running invoke()",
+)
+WORKERS = metrics.Gauge(
+    "scalp_inference_workers",
+    "Interpreter workers started",
+)
+BUSY_SECONDS = metrics.Counter(
+    "scalp_inference_busy_seconds_total",
+    "Cumulative invoke() time across workers; rate() / workers is utilization",
+)
+
+_STOP = object()
+
+
+def _bucket(n: int, max_batch_size: int) -> int:
+    # round up to a power of two so resize/allocate_tensors happens rarely
+    size = 1
+    while size < n:
+        size *= 2
+    return min(size, max_batch_size)
+
+
+class BatchingEngine:
+    """Coalesces concurrent predictions into a single interpreter invoke().
+
+    Inputs are gathered until ``max_batch_size`` images are queued or
+    ``max_wait_ms`` has passed since the first one, then run together and
+    each caller's ``Future`` receives its own row of the output.
+
+    Every interpreter passed in gets its own worker thread and is only ever
+    touched from that thread, so workers pull batches from the shared queue
+    and invoke in parallel without locking.
+
+    ``submit`` takes one image (batch dimension 1) and resolves to its
+    output row; ``submit_many`` takes a stack of images that is kept
+    together in one batch and resolves to all of their rows. With
+    ``embeddings`` and a model that has an embedding output, each row is
+    the class scores followed by the embedding.
+    """
+
+    def __init__(self, interpreters, max_batch_size: int = 8, max_wait_ms: float = 5.0,
+                 embeddings: bool = False):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._workers = [
+            _Worker(interp, self.max_batch_size, embeddings) for interp in interpreters
+        ]
+        self._threads = [
+            threading.Thread(
+                target=self._run, args=(worker,), name=f"inference-{i}", daemon=True
+            )
+            for i, worker in enumerate(self._workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        WORKERS.inc(len(self._workers))
+
+    def submit(self, x: np.ndarray) -> Future:
+        return self._put(x, many=False)
+
+    def submit_many(self, xs: np.ndarray) -> Future:
+        return self._put(xs, many=True)
+
+    def _put(self, x, many):
+        fut = Future()
+        self._queue.put((x, fut, time.perf_counter(), many, profiling.current_request()))
+        QUEUE_DEPTH.inc(len(x))
+        return fut
+
+    def close(self, timeout: float | None = None):
+        self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        WORKERS.dec(len(self._workers))
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is _STOP:
+            # leave it for the other workers, each of which stops on it in turn
+            self._queue.put(_STOP)
+            return None
+
+        items = [first]
+        rows = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            items.append(item)
+            rows += len(item[0])
+        return items
+
+    def _run(self, worker):
+        while True:
+            items = self._collect()
+            if items is None:
+                return
+
+            QUEUE_DEPTH.dec(sum(len(x) for x, *_ in items))
+            # callers that gave up while queued are dropped from the batch
+            items = [item for item in items if item[1].set_running_or_notify_cancel()]
+            if not items:
+                continue
+
+            started = time.perf_counter()
+            for _, _, enqueued, _, _ in items:
+                QUEUE_WAIT.observe(started - enqueued)
+
+            BUSY_WORKERS.inc()
+            try:
+                # a batch counts for every profiled request with an image in it
+                with profiling.working_for(owner for *_, owner in items):
+                    probs = worker.invoke(np.concatenate([x for x, *_ in items], axis=0))
+                offset = 0
+                for x, fut, _, many, _ in items:
+                    n = len(x)
+                    fut.set_result(probs[offset:offset + n] if many else probs[offset])
+                    offset += n
+            except Exception as e:
+                # the worker thread must outlive a bad batch; whoever has no result yet gets the error
+                for _, fut, *_ in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+            finally:
+                BUSY_WORKERS.dec()
+
+
+class _Worker:
+    def __init__(self, interpreter, max_batch_size: int, embeddings: bool = False):
+        self.interpreter = interpreter
+        self.max_batch_size = max_batch_size
+        self._input = interpreter.get_input_details()[0]
+        scores, embedding = split_outputs(interpreter)
+        self._outputs = [scores] + ([embedding] if embeddings and embedding is not None else [])
+        self._allocated = int(self._input["shape"][0]) or 1
+
+    def invoke(self, batch: np.ndarray) -> np.ndarray:
+        # a submit_many() stack can be larger than one interpreter batch
+        return np.concatenate([
+            self._invoke(batch[start:start + self.max_batch_size])
+            for start in range(0, len(batch), self.max_batch_size)
+        ], axis=0)
+
+    def _invoke(self, batch: np.ndarray) -> np.ndarray:
+        started = time.perf_counter()
+        n = batch.shape[0]
+        size = _bucket(n, self.max_batch_size)
+        if size != self._allocated:
+            shape = list(self._input["shape"])
+            shape[0] = size
+            self.interpreter.resize_tensor_input(self._input["index"], shape)
+            self.interpreter.allocate_tensors()
+            self._allocated = size
+
+        if n < size:
+            pad = np.zeros((size - n,) + batch.shape[1:], dtype=batch.dtype)
+            batch = np.concatenate([batch, pad], axis=0)
+
+        self.interpreter.set_tensor(self._input["index"], batch)
+        self.interpreter.invoke()
+        probs = np.concatenate([self._read(output, n) for output in self._outputs], axis=1)
+
+        elapsed = time.perf_counter() - started
+        BATCH_SIZE.observe(n)
+        INVOKE_SECONDS.observe(elapsed)
+        BUSY_SECONDS.inc(elapsed)
+        return probs
+
+    def _read(self, output, n: int) -> np.ndarray:
+        values = self.interpreter.get_tensor(output["index"])[:n].reshape(n, -1)
+        scale, zero_point = output["quantization"]
+        if scale and np.issubdtype(values.dtype, np.integer):
+            # full-integer models return quantized scores
+            return (values.astype(np.float32) - zero_point) * scale
+        return values.astype(np.float32, copy=False)
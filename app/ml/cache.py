@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from app.utils import metrics
+
+CACHE_REQUESTS = metrics.Counter(
+    "scalp_prediction_cache_requests_total",
+    "Prediction cache lookups by tier and outcome",
+    ("tier", "result"),
+)
+CACHE_ENTRIES = metrics.Gauge(
+    "scalp_prediction_cache_memory_entries",
+    "Entries held in the in-process prediction cache",
+)
+
+
+def image_digest(source) -> str:
+    if hasattr(source, "read"):
+        source.seek(0)
+        return hashlib.file_digest(source, "sha256").hexdigest()
+    return hashlib.sha256(source).hexdigest()
+
+
+def file_digest(*paths) -> str:
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(hashlib.file_digest(f, "sha256").digest())
+    return h.hexdigest()
+
+
+def unpack(entry):
+    label, confidence, status, error = entry
+    if error:
+        raise ValueError(error)
+    return label, confidence, status
+
+
+class PredictionCache:
+    """Prediction results keyed by image digest, for one model version.
+
+    Entries are ``(label, confidence, status, error)``; quality-gate and
+    low-confidence rejections are cached as an error message. The memory
+    tier is a per-process LRU, the persistent tier a SQLite file shared by
+    every worker on the host. Rows from other model versions are purged on
+    start-up, so swapping the model file invalidates the cache.
+    """
+
+    def __init__(self, model_version: str, path: str | None = None, max_entries: int = 4096):
+        self.model_version = model_version
+        self.path = path
+        self.max_entries = max(0, max_entries)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if self.path:
+            conn = self._conn()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " digest TEXT NOT NULL,"
+                " model_version TEXT NOT NULL,"
+                " label TEXT,"
+                " confidence REAL,"
+                " status TEXT,"
+                " error TEXT,"
+                " PRIMARY KEY (digest, model_version))"
+            )
+            conn.execute(
+                "DELETE FROM predictions WHERE model_version != ?", (model_version,)
+            )
+            conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, digest: str):
+        with self._lock:
+            entry = self._memory.get(digest)
+            if entry is not None:
+                self._memory.move_to_end(digest)
+        if entry is not None:
+            CACHE_REQUESTS.inc(tier="memory", result="hit")
+            return entry
+        CACHE_REQUESTS.inc(tier="memory", result="miss")
+
+        if not self.path:
+            return None
+
+        row = self._conn().execute(
+            "SELECT label, confidence, status, error FROM predictions"
+            " WHERE digest = ? AND model_version = ?",
+            (digest, self.model_version),
+        ).fetchone()
+        if row is None:
+            CACHE_REQUESTS.inc(tier="persistent", result="miss")
+            return None
+
+        CACHE_REQUESTS.inc(tier="persistent", result="hit")
+        entry = tuple(row)
+        self._remember(digest, entry)
+        return entry
+
+    def put(self, digest: str, entry):
+        self._remember(digest, entry)
+        if not self.path:
+            return
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO predictions"
+            " (digest, model_version, label, confidence, status, error)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (digest, self.model_version, *entry),
+        )
+        conn.commit()
+
+    def _remember(self, digest, entry):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._memory[digest] = entry
+            self._memory.move_to_end(digest)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+            CACHE_ENTRIES.set(len(self._memory))
@@ -0,0 +1,78 @@
+import time
+
+from PIL import Image, UnidentifiedImageError
+
+from app.ml import quality
+from app.ml.instrumentation import STAGE_SECONDS, reject
+from app.utils import metrics
+from app.utils.ingest import open_source
+
+DECODED_MEGAPIXELS = metrics.Histogram(
+    "scalp_decoded_megapixels",
+    "Size of the decoded image after draft/reduce",
+    buckets=(0.05, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+SOURCE_MEGAPIXELS = metrics.Histogram(
+    "scalp_source_megapixels",
+    "Size of the upload as stored in the file",
+    buckets=(0.05, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+
+MODEL_SIDE = 224
+
+_EXIF_ORIENTATION = 0x0112
+_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def target_side() -> int:
+    # smallest long side that still serves both the quality gate and the model
+    return max(quality.WORKING_MAX_SIDE, MODEL_SIDE)
+
+
+def decode_image(source):
+    """Decode an upload straight to the smallest resolution the pipeline needs.
+
+    JPEGs are scaled in the DCT domain with ``draft()``, other formats are
+    box-reduced by an integer factor before the RGB conversion. EXIF
+    orientation is applied last, on the small image. ``source`` is bytes or
+    a seekable file. Returns the RGB image and the original (width, height)
+    as stored in the file.
+    """
+    started = time.perf_counter()
+    try:
+        img = Image.open(open_source(source))
+        source_size = img.size
+        orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+
+        side = target_side()
+        longest = max(source_size)
+        if img.format == "JPEG" and longest > side:
+            scale = side / longest
+            img.draft("RGB", (round(source_size[0] * scale), round(source_size[1] * scale)))
+
+        img.load()
+        factor = max(img.size) // side
+        if factor >= 2:
+            if img.mode in ("P", "1", "I;16"):
+                img = img.convert("RGB")
+            img = img.reduce(factor)
+
+        img = img.convert("RGB")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise reject("invalid_image", "File bukan gambar valid")
+
+    if orientation in _TRANSPOSE:
+        img = img.transpose(_TRANSPOSE[orientation])
+
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="decode")
+    SOURCE_MEGAPIXELS.observe(source_size[0] * source_size[1] / 1e6)
+    DECODED_MEGAPIXELS.observe(img.width * img.height / 1e6)
+    return img, source_size
@@ -0,0 +1,326 @@
+"""Penultimate-layer embeddings of past predictions, for similar-case search.
+
+With ``EMBEDDINGS=1`` and a model converted with an embedding output
+(``python -m app.ml.registry convert ... --embeddings``), every image that
+goes through the model leaves its feature vector here, and every History
+row written for it is appended to an on-disk index keyed by History.id:
+
+    <EMBEDDING_INDEX_DIR>/<model version>/vectors.f16   L2-normalized float16 rows
+    <EMBEDDING_INDEX_DIR>/<model version>/meta.bin      one META_DTYPE record per row
+
+Both files are append-only and memory-mapped for search, so the index is
+shared by every process on the host and never has to fit in RAM. A new
+model version starts a new index; embeddings from different weights are
+not comparable.
+"""
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from app.utils import metrics
+from app.utils.ttl_cache import TTLCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EMBEDDINGS = os.getenv("EMBEDDINGS", "0").lower() in ("1", "true", "yes")
+EMBEDDING_INDEX_DIR = os.getenv(
+    "EMBEDDING_INDEX_DIR", os.path.join(BASE_DIR, "..", "..", "embeddings")
+)
+# rows scored per step of a full scan; bounds the float32 working set
+SEARCH_CHUNK_ROWS = int(os.getenv("EMBEDDING_SEARCH_CHUNK_ROWS", "16384"))
+# rows appended since a lookup column was last sorted that are scanned
+# directly; past this (or 1/64 of the index, if larger) it is re-sorted
+UNSORTED_TAIL_ROWS = 8192
+# an upload whose signature is within this many bits of an indexed image
+# reuses that image's result instead of running the model; 0 disables
+NEAR_DUPLICATE_MAX_BITS = int(os.getenv("NEAR_DUPLICATE_MAX_BITS", "0"))
+
+SIGNATURE_SIDE = 16
+META_DTYPE = np.dtype([
+    ("history_id", "<i8"),
+    ("user_id", "<i8"),
+    # first 8 bytes of the image's sha256
+    ("digest", "<u8"),
+    ("label", "<u2"),
+    ("confidence", "<f4"),
+    # 256-bit difference hash of the model input
+    ("signature", "u1", (SIGNATURE_SIDE * SIGNATURE_SIDE // 8,)),
+])
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+NEAR_DUPLICATES = metrics.Counter(
+    "scalp_near_duplicate_reuses_total",
+    "Uploads answered from a near-duplicate in the embedding index instead of the model",
+)
+INDEX_ROWS = metrics.Gauge(
+    "scalp_embedding_index_rows",
+    "Rows in the embedding index",
+)
+
+# set by hair_classification.load_model() when embeddings are active
+index = None
+
+# embeddings wait here between the model pass and the History insert
+_pending = TTLCache(max_entries=4096, ttl=600)
+
+
+def signature(x: np.ndarray) -> np.ndarray:
+    """Difference hash of a (quantized or float) model input, as 32 packed bytes.
+
+    Compares neighbouring cells of a 16x17 grayscale thumbnail, which is
+    unaffected by the per-channel offsets and the input quantization.
+    """
+    gray = np.asarray(x[0], dtype=np.float32).mean(axis=-1)
+    small = np.asarray(
+        Image.fromarray(gray, mode="F").resize((SIGNATURE_SIDE + 1, SIGNATURE_SIDE), Image.BOX)
+    )
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+
+def _digest_key(digest: str) -> int:
+    return int(digest[:16], 16)
+
+
+def remember(digest: str, vector: np.ndarray | None = None, sig: np.ndarray | None = None):
+    """Hold an image's embedding and/or signature until its History row exists."""
+    entry = dict(_pending.get(digest) or {})
+    if vector is not None:
+        entry["vector"] = vector
+    if sig is not None:
+        entry["signature"] = sig
+    _pending.set(digest, entry)
+
+
+class _SortedColumn:
+    """One META_DTYPE column sorted for lookups by value.
+
+    Covers the first ``rows`` rows of the index; rows appended after that
+    are scanned directly until there are enough of them to sort again.
+    """
+
+    def __init__(self, meta, column: str):
+        self.column = column
+        self.rows = len(meta)
+        values = np.asarray(meta[column])
+        # stable, so the rows of equal values stay in append order
+        self.order = np.argsort(values, kind="stable")
+        self.keys = values[self.order]
+
+    def stale(self, rows: int) -> bool:
+        return rows - self.rows > max(UNSORTED_TAIL_ROWS, self.rows // 64)
+
+    def rows_with(self, meta, value) -> np.ndarray:
+        """Every row holding ``value``, oldest first."""
+        # a Python int against uint64 keys would cast the whole column
+        value = self.keys.dtype.type(value)
+        lo = np.searchsorted(self.keys, value, "left")
+        hi = np.searchsorted(self.keys, value, "right")
+        tail = self.rows + np.flatnonzero(meta[self.column][self.rows:] == value)
+        return np.concatenate([self.order[lo:hi], tail])
+
+
+class EmbeddingIndex:
+    def __init__(self, path: str, dim: int, labels: list[str]):
+        self.path = path
+        self.dim = dim
+        self.labels = labels
+        self._label_ids = {label: i for i, label in enumerate(labels)}
+        self._vectors_path = os.path.join(path, "vectors.f16")
+        self._meta_path = os.path.join(path, "meta.bin")
+        self._lock_path = os.path.join(path, "lock")
+        self._row_bytes = dim * np.dtype(np.float16).itemsize
+        self._maps = (-1, None, None)
+        self._columns = {}
+        self._maps_lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        header = os.path.join(path, "index.json")
+        if not os.path.exists(header):
+            with open(header, "w") as f:
+                json.dump({"dim": dim, "labels": labels}, f)
+        INDEX_ROWS.set_function(lambda: len(self))
+
+    def __len__(self):
+        return self._rows()
+
+    def _rows(self) -> int:
+        # a writer that died between the two appends leaves extra vector bytes
+        try:
+            metas = os.path.getsize(self._meta_path) // META_DTYPE.itemsize
+            vectors = os.path.getsize(self._vectors_path) // self._row_bytes
+        except FileNotFoundError:
+            return 0
+        return min(metas, vectors)
+
+    def _remap(self, n: int):
+        # caller holds _maps_lock; the files only grow, so a smaller count is a stale read
+        if n > self._maps[0]:
+            if n == 0:
+                self._maps = (0, np.zeros(0, META_DTYPE), np.zeros((0, self.dim), np.float16))
+            else:
+                self._maps = (
+                    n,
+                    np.memmap(self._meta_path, META_DTYPE, mode="r", shape=(n,)),
+                    np.memmap(self._vectors_path, np.float16, mode="r", shape=(n, self.dim)),
+                )
+        return self._maps[1], self._maps[2]
+
+    def _mapped(self):
+        n = self._rows()
+        with self._maps_lock:
+            return self._remap(n)
+
+    def _rows_with(self, column: str, value):
+        # binary search in the sorted column plus a scan of the rows appended since
+        n = self._rows()
+        with self._maps_lock:
+            meta, _ = self._remap(n)
+            sorted_column = self._columns.get(column)
+            if sorted_column is None or sorted_column.stale(len(meta)):
+                sorted_column = self._columns[column] = _SortedColumn(meta, column)
+        return sorted_column.rows_with(meta, value)
+
+    def append(self, rows):
+        """Append ``(history_id, user_id, digest, label, confidence, signature, vector)`` rows."""
+        if not rows:
+            return
+        meta = np.zeros(len(rows), META_DTYPE)
+        vectors = np.zeros((len(rows), self.dim), np.float32)
+        for i, (history_id, user_id, digest, label, confidence, sig, vector) in enumerate(rows):
+            meta[i] = (history_id, user_id or 0, _digest_key(digest),
+                       self._label_ids.get(label, 0xFFFF), confidence, sig)
+            vectors[i] = vector
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        # several web workers append to the same files
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            n = self._rows()
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(n * self._row_bytes)
+                f.write(vectors.astype(np.float16).tobytes())
+            with open(self._meta_path, "ab") as f:
+                f.truncate(n * META_DTYPE.itemsize)
+                f.write(meta.tobytes())
+
+    def _find(self, column: str, value) -> int | None:
+        rows = self._rows_with(column, value)
+        return int(rows[-1]) if rows.size else None
+
+    def vector(self, history_id: int) -> np.ndarray | None:
+        row = self._find("history_id", history_id)
+        if row is None:
+            return None
+        return np.asarray(self._mapped()[1][row], dtype=np.float32)
+
+    def by_digest(self, digest: str):
+        """The newest ``(vector, signature)`` stored for the same image, if any."""
+        row = self._find("digest", _digest_key(digest))
+        if row is None:
+            return None
+        meta, vectors = self._mapped()
+        return np.asarray(vectors[row], dtype=np.float32), np.array(meta[row]["signature"])
+
+    def search(self, query: np.ndarray, k: int = 5, user_id: int | None = None,
+               exclude=()) -> list[tuple[int, float]]:
+        """Top-``k`` ``(history_id, cosine similarity)``, best first.
+
+        With ``user_id`` only that user's rows are looked up and scored;
+        otherwise the whole index is scanned ``SEARCH_CHUNK_ROWS`` rows at
+        a time.
+        """
+        user_rows = self._rows_with("user_id", user_id) if user_id is not None else None
+        meta, vectors = self._mapped()
+        q = np.asarray(query, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        skip = np.asarray(list(exclude), dtype=np.int64)
+
+        if user_rows is not None:
+            chunks = [user_rows]
+        else:
+            chunks = [np.arange(s, min(s + SEARCH_CHUNK_ROWS, len(meta)))
+                      for s in range(0, len(meta), SEARCH_CHUNK_ROWS)]
+
+        best_rows = np.zeros(0, np.int64)
+        best_scores = np.zeros(0, np.float32)
+        for rows in chunks:
+            if not rows.size:
+                continue
+            # a full scan slices contiguous chunks, so only that chunk is paged in
+            block = vectors[rows[0]:rows[-1] + 1] if user_id is None else vectors[rows]
+            scores = np.asarray(block, dtype=np.float32) @ q
+            if skip.size:
+                keep = ~np.isin(meta["history_id"][rows], skip)
+                rows, scores = rows[keep], scores[keep]
+            rows = np.concatenate([best_rows, rows])
+            scores = np.concatenate([best_scores, scores])
+            if scores.size > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                rows, scores = rows[top], scores[top]
+            best_rows, best_scores = rows, scores
+
+        order = np.argsort(-best_scores)
+        ids = meta["history_id"][best_rows[order]]
+        return [(int(i), float(s)) for i, s in zip(ids, best_scores[order])]
+
+    def near_duplicate(self, sig: np.ndarray, max_bits: int = NEAR_DUPLICATE_MAX_BITS):
+        """``(label, confidence, vector)`` of the closest indexed image within ``max_bits``.
+
+        A linear scan of every signature, 32 bytes a row; see
+        ``benchmarks.embedding_index_bench`` for what that costs at scale.
+        """
+        if max_bits <= 0:
+            return None
+        meta, vectors = self._mapped()
+        best, best_bits = None, max_bits + 1
+        for start in range(0, len(meta), SEARCH_CHUNK_ROWS):
+            signatures = meta["signature"][start:start + SEARCH_CHUNK_ROWS]
+            bits = _POPCOUNT[signatures ^ sig].sum(axis=1)
+            i = int(np.argmin(bits))
+            if bits[i] < best_bits:
+                best, best_bits = start + i, int(bits[i])
+        if best is None or meta[best]["label"] >= len(self.labels):
+            return None
+        row = meta[best]
+        return (self.labels[row["label"]], float(row["confidence"]),
+                np.asarray(vectors[best], dtype=np.float32))
+
+
+def open_index(model_version: str, dim: int, labels: list[str]):
+    global index
+    index = EmbeddingIndex(os.path.join(EMBEDDING_INDEX_DIR, model_version), dim, labels)
+    return index
+
+
+def close_index():
+    global index
+    index = None
+
+
+def index_histories(history_ids, rows):
+    """Append freshly written History rows whose images have an embedding."""
+    if index is None:
+        return
+    entries = []
+    for history_id, row in zip(history_ids, rows):
+        digest = os.path.splitext(os.path.basename(row["image_path"] or ""))[0]
+        if len(digest) != 64:
+            continue
+        pending = _pending.get(digest) or {}
+        vector, sig = pending.get("vector"), pending.get("signature")
+        if vector is None:
+            # a repeat upload answered from the prediction cache
+            found = index.by_digest(digest)
+            if found is None:
+                continue
+            vector, sig = found
+        if sig is None:
+            sig = np.zeros(META_DTYPE["signature"].shape, np.uint8)
+        entries.append((history_id, row.get("user_id"), digest, row["disease"],
+                        row["confidence"], sig, vector))
+    index.append(entries)
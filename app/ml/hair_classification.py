@@ -1,71 +1,188 @@
-import os, io
+import os
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import tensorflow as tf
-from PIL import Image, UnidentifiedImageError
+
+from app.ml import embeddings
+from app.ml.batching import BatchingEngine
+from app.ml.cache import PredictionCache, file_digest, image_digest, unpack
+from app.ml.decode import decode_image
+from app.ml.instrumentation import PREDICTIONS_IN_FLIGHT, STAGE_SECONDS, reject
+from app.ml.quality import check_quality
+from app.ml.registry import MODEL_DIR, ModelVariant, get_variant
+from app.ml.runtime import XNNPACK, interpreter_class, make_interpreter
+from app.ml.sidecar import SIDECAR_SOCKET, SidecarClient
+from app.utils import metrics, profiling
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_DIR = os.path.join(BASE_DIR, "model")
 
-interpreter = tf.lite.Interpreter(
-    model_path=os.path.join(MODEL_DIR, "vgg16_final.tflite")
+CPU_COUNT = os.cpu_count() or 1
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+INFERENCE_WORKERS = max(1, int(os.getenv("INFERENCE_WORKERS", "1")))
+INTERPRETER_THREADS = int(
+    os.getenv("INTERPRETER_THREADS", str(max(1, CPU_COUNT // INFERENCE_WORKERS)))
+)
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(CPU_COUNT)))
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_PATH = os.getenv(
+    "PREDICTION_CACHE_PATH",
+    os.path.join(BASE_DIR, "..", "..", "prediction_cache.db")
 )
-interpreter.allocate_tensors()
+WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "2"))
 
-labels = [l.strip() for l in open(os.path.join(MODEL_DIR, "labels.txt"))]
-input_details = interpreter.get_input_details()
-output_details = interpreter.get_output_details()
 
-def preprocess(image_bytes):
-    try:
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    except UnidentifiedImageError:
-        raise ValueError("File bukan gambar valid")
+def load_interpreter(path, num_threads: int = INTERPRETER_THREADS, xnnpack: bool = XNNPACK):
+    interp = make_interpreter(path, num_threads, xnnpack)
+    interp.allocate_tensors()
+    return interp
+
+
+def warm_up(interp, runs: int = WARMUP_RUNS):
+    # the first invoke() allocates arenas and packs weights; pay it here
+    detail = interp.get_input_details()[0]
+    interp.set_tensor(detail["index"], np.zeros(detail["shape"], dtype=detail["dtype"]))
+    for _ in range(runs):
+        interp.invoke()
+
+
+LABELS_PATH = os.path.join(MODEL_DIR, "labels.txt")
+labels = [l.strip() for l in open(LABELS_PATH)]
+
+# set by load_model(); the app calls it from its lifespan hook
+runtime = None
+variant = None
+interpreters = []
+input_details = output_details = None
+engine = None
+MODEL_VERSION = None
+cache = None
+load_seconds = None
+load_error = None
+_ready = threading.Event()
+_load_lock = threading.Lock()
+
 
-    if img.width < 200 or img.height < 200:
-        raise ValueError("Gambar terlalu kecil atau tidak jelas")
+def _load_local():
+    # returns whether the engine's output rows carry embeddings
+    global runtime, variant, interpreters, input_details, output_details, engine, MODEL_VERSION
 
-    img_np = np.array(img)
+    runtime, _ = interpreter_class()
+    selected = get_variant()
+    # one interpreter per inference worker; tflite interpreters are not thread-safe
+    loaded = [load_interpreter(selected.path) for _ in range(INFERENCE_WORKERS)]
+    for interp in loaded:
+        warm_up(interp)
+    selected.inspect(loaded[0])
 
-    gray = np.mean(img_np, axis=2)
+    # changes whenever the weights or the label list change
+    MODEL_VERSION = file_digest(selected.path, LABELS_PATH)[:16]
+    variant = selected
+    interpreters = loaded
+    input_details = loaded[0].get_input_details()
+    output_details = loaded[0].get_output_details()
+    engine = BatchingEngine(
+        interpreters,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_wait_ms=MAX_WAIT_MS,
+        embeddings=embeddings.EMBEDDINGS,
+    )
+    if embeddings.EMBEDDINGS and not selected.embedding_dim:
+        logger.warning("EMBEDDINGS is set but model %s has no embedding output", selected.name)
+    return embeddings.EMBEDDINGS and bool(selected.embedding_dim)
 
-    brightness = np.mean(gray)
-    contrast = np.std(gray)
-    color_std = np.std(img_np, axis=(0, 1))  # per channel
-    mean_color_std = np.mean(color_std)
-    gx = np.abs(np.diff(gray, axis=1))
-    gy = np.abs(np.diff(gray, axis=0))
-    edge_strength = np.mean(gx) + np.mean(gy)
 
+def _connect_sidecar(path):
+    # the sidecar owns the interpreters; take the model details from it
+    global runtime, variant, labels, engine, MODEL_VERSION
 
-    if mean_color_std < 15:
-        raise ValueError("Gambar bukan citra kulit kepala yang valid")
-   
-    if brightness < 40:
-        raise ValueError("Gambar terlalu gelap dan tidak terdeteksi sebagai kulit kepala")
+    client = SidecarClient(path)
+    served = client.connect()
+    meta = served["variant"]
+    variant = ModelVariant(
+        meta["name"], meta["path"], meta["description"],
+        input_dtype=np.dtype(meta["input_dtype"]).type,
+        input_scale=meta["input_quantization"][0],
+        input_zero_point=meta["input_quantization"][1],
+        output_dtype=np.dtype(meta["output_dtype"]).type,
+        output_scale=meta["output_quantization"][0],
+        output_zero_point=meta["output_quantization"][1],
+        embedding_dim=meta["embedding_dim"],
+    )
+    runtime = f"sidecar ({served['runtime']})"
+    labels = served["labels"]
+    MODEL_VERSION = served["model_version"]
+    engine = client
+    return served["embeddings"]
 
-    if contrast < 18:
-        raise ValueError("Gambar terlalu polos dan bukan citra kulit kepala")
 
-    if edge_strength < 12:
-        raise ValueError("Gambar Tidak ditemukan tekstur rambut")
-    
-    laplacian = np.var(np.diff(gray, 2))
-    if laplacian < 15:
-        raise ValueError("Gambar terlalu halus / blur")
-    
-    r = img_np[:,:,0]
-    g = img_np[:,:,1]
-    b = img_np[:,:,2]
+def load_model(sidecar: str | None = SIDECAR_SOCKET):
+    """Load, warm up and publish the interpreters. Safe to call more than once.
 
-    skin_mask = (r > 95) & (g > 40) & (b > 20) & \
-                ((np.max(img_np,axis=2)-np.min(img_np,axis=2)) > 15) & \
-                (np.abs(r-g) > 15) & (r > g) & (r > b)
+    With ``sidecar`` set (``INFERENCE_SIDECAR_SOCKET``) no interpreter is
+    loaded in this process; the engine forwards to the inference sidecar
+    listening on that path instead.
+    """
+    global cache, load_seconds, load_error
 
-    skin_ratio = np.sum(skin_mask) / skin_mask.size
+    with _load_lock:
+        if _ready.is_set():
+            return
+        started = time.perf_counter()
+        try:
+            with_embeddings = _connect_sidecar(sidecar) if sidecar else _load_local()
+            cache = PredictionCache(
+                MODEL_VERSION,
+                path=PREDICTION_CACHE_PATH or None,
+                max_entries=PREDICTION_CACHE_SIZE,
+            )
+            if with_embeddings:
+                embeddings.open_index(MODEL_VERSION, variant.embedding_dim, labels)
+        except Exception as e:
+            load_error = f"{type(e).__name__}: {e}"
+            logger.exception("model load failed")
+            raise
 
-    if skin_ratio < 0.10:
-        raise ValueError("Gambar tidak terdeteksi warna kulit kepala")
+        load_error = None
+        load_seconds = time.perf_counter() - started
+        _ready.set()
+        logger.info("model %s (%s) loaded with %s in %.2fs",
+                    MODEL_VERSION, variant.name, runtime, load_seconds)
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def unload_model():
+    global engine
+    with _load_lock:
+        _ready.clear()
+        embeddings.close_index()
+        if engine is not None:
+            engine.close()
+            engine = None
+
+
+# decode + quality gate run here so they never block the event loop
+executor = ThreadPoolExecutor(
+    max_workers=PREPROCESS_WORKERS,
+    thread_name_prefix="preprocess"
+)
+
+PREPROCESS_QUEUE = metrics.Gauge(
+    "scalp_preprocess_queue_depth",
+    "Decode/quality-gate jobs waiting for a preprocess thread",
+)
+PREPROCESS_QUEUE.set_function(executor._work_queue.qsize)
 
+def normalize(img):
+    """Resized, BGR mean-subtracted float32 batch of one, as VGG16 expects."""
     img = img.resize((224, 224))
     arr = np.array(img).astype(np.float32)
 
@@ -74,23 +191,147 @@ def preprocess(image_bytes):
     arr[..., 1] -= 116.779
     arr[..., 2] -= 123.68
 
-    arr = np.expand_dims(arr, axis=0)
-    return arr.astype(input_details[0]["dtype"])
+    return np.expand_dims(arr, axis=0)
 
-def predict(image_bytes):
-    x = preprocess(image_bytes)
-    interpreter.set_tensor(input_details[0]["index"], x)
-    interpreter.invoke()
+def preprocess(image, model_variant: ModelVariant | None = None):
+    # ``model_variant`` lets a process that loaded no model quantize for one
+    img, (width, height) = decode_image(image)
 
-    probs = interpreter.get_tensor(output_details[0]["index"])[0]
+    if width < 200 or height < 200:
+        raise reject("too_small", "Gambar terlalu kecil atau tidak jelas")
+
+    with STAGE_SECONDS.time(stage="quality"):
+        check_quality(img)
+
+    # int8 variants take quantized input; float variants just get a cast
+    with STAGE_SECONDS.time(stage="resize"):
+        return (model_variant or variant).quantize(normalize(img))
+
+def _prepare(image, digest):
+    # returns (digest, cached entry, None) on a hit, (digest, None, input) on a miss
+    digest = digest or image_digest(image)
+    entry = cache.get(digest)
+    if entry is not None:
+        return digest, entry, None
+    try:
+        x = preprocess(image)
+    except ValueError as e:
+        cache.put(digest, (None, None, None, str(e)))
+        raise
+    if embeddings.index is not None:
+        entry = _near_duplicate(digest, x)
+        if entry is not None:
+            return digest, entry, None
+    return digest, None, x
+
+def _near_duplicate(digest, x):
+    # the signature is kept either way, for this image's index entry
+    sig = embeddings.signature(x)
+    found = embeddings.index.near_duplicate(sig)
+    if found is None:
+        embeddings.remember(digest, sig=sig)
+        return None
+    label, confidence, vector = found
+    embeddings.remember(digest, vector, sig)
+    entry = (label, confidence, confidence_status(confidence), None)
+    cache.put(digest, entry)
+    embeddings.NEAR_DUPLICATES.inc()
+    return entry
+
+def _finish(digest, probs):
+    vector = None
+    if len(probs) > len(labels):
+        # the engine appends the embedding to the class scores
+        probs, vector = probs[:len(labels)], probs[len(labels):]
+    try:
+        entry = (*decide(probs), None)
+    except ValueError as e:
+        entry = (None, None, None, str(e))
+    else:
+        if vector is not None:
+            embeddings.remember(digest, vector)
+    cache.put(digest, entry)
+    return entry
+
+def predict(image, digest=None):
+    digest, entry, x = _prepare(image, digest)
+    if entry is None:
+        with STAGE_SECONDS.time(stage="inference"):
+            probs = engine.submit(x).result()
+        entry = _finish(digest, probs)
+    return unpack(entry)
+
+async def predict_async(image, digest=None):
+    loop = asyncio.get_running_loop()
+    PREDICTIONS_IN_FLIGHT.inc()
+    try:
+        digest, entry, x = await loop.run_in_executor(
+            executor, profiling.bind(_prepare), image, digest
+        )
+        if entry is None:
+            # batch queue wait plus the batched invoke, as seen by this request
+            with STAGE_SECONDS.time(stage="inference"):
+                probs = await asyncio.wrap_future(engine.submit(x))
+            entry = await loop.run_in_executor(executor, profiling.bind(_finish), digest, probs)
+    finally:
+        PREDICTIONS_IN_FLIGHT.dec()
+    return unpack(entry)
+
+async def predict_many_async(images, digests):
+    """Predict several images with one engine submission.
+
+    Decode and quality gate run in parallel on the executor; every image
+    that passes goes to the model in a single stacked batch. Returns one
+    ``(label, confidence, status)`` or exception per image, in order.
+    """
+    loop = asyncio.get_running_loop()
+    PREDICTIONS_IN_FLIGHT.inc(len(images))
+    try:
+        prepared = await asyncio.gather(
+            *[loop.run_in_executor(executor, profiling.bind(_prepare), image, digest)
+              for image, digest in zip(images, digests)],
+            return_exceptions=True
+        )
+
+        pending = [
+            i for i, p in enumerate(prepared)
+            if not isinstance(p, BaseException) and p[1] is None
+        ]
+        if pending:
+            xs = np.concatenate([prepared[i][2] for i in pending], axis=0)
+            with STAGE_SECONDS.time(stage="inference"):
+                probs = await asyncio.wrap_future(engine.submit_many(xs))
+            entries = await loop.run_in_executor(
+                executor,
+                profiling.bind(lambda: [_finish(prepared[i][0], p) for i, p in zip(pending, probs)])
+            )
+            for i, entry in zip(pending, entries):
+                prepared[i] = (prepared[i][0], entry, None)
+    finally:
+        PREDICTIONS_IN_FLIGHT.dec(len(images))
+
+    results = []
+    for p in prepared:
+        if isinstance(p, BaseException):
+            results.append(p)
+            continue
+        try:
+            results.append(unpack(p[1]))
+        except ValueError as e:
+            results.append(e)
+    return results
+
+def decide(probs):
     idx = int(np.argmax(probs))
     confidence = float(probs[idx])
 
     if confidence < 0.40:
-        raise ValueError("Gambar bukan citra kulit kepala yang valid")
+        raise reject("low_confidence", "Gambar bukan citra kulit kepala yang valid")
+
+    return labels[idx], confidence, confidence_status(confidence)
 
-    status = "high" if confidence >= 0.80 else "low"
-    return labels[idx], confidence, status
+def confidence_status(confidence):
+    return "high" if confidence >= 0.80 else "low"
 
 #  BUSINESS LOGIC 
 DISEASE_INFO = {
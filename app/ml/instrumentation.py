@@ -0,0 +1,26 @@
+from app.utils import metrics
+
+STAGE_SECONDS = metrics.Histogram(
+    "scalp_stage_seconds",
+    "Time spent in each /predict pipeline stage",
+    ("stage",),
+)
+REJECTIONS = metrics.Counter(
+    "scalp_rejections_total",
+    "Uploads rejected by the ingest checks, the quality gate or the model, by reason",
+    ("reason",),
+)
+PREDICTIONS_IN_FLIGHT = metrics.Gauge(
+    "scalp_predictions_in_flight",
+    "Images between decode and a final result",
+)
+
+
+def reject(reason: str, message: str) -> ValueError:
+    """Count a rejection and build the user-facing error for it.
+
+    Cached rejections are served without coming through here, so this counts
+    how often each check actually fires.
+    """
+    REJECTIONS.inc(reason=reason)
+    return ValueError(message)
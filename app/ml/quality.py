@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from app.ml.instrumentation import reject
+
+# statistics are computed on a copy no larger than this on its long side.
+# edge/blur thresholds depend on resolution, so lowering this makes large
+# uploads look sharper; check with benchmarks/quality_gate_parity.py
+WORKING_MAX_SIDE = int(os.getenv("QUALITY_MAX_SIDE", "1600"))
+
+MIN_COLOR_STD = 15
+MIN_BRIGHTNESS = 40
+MIN_CONTRAST = 18
+MIN_EDGE_STRENGTH = 12
+MIN_LAPLACIAN = 15
+MIN_SKIN_RATIO = 0.10
+
+
+def working_image(img: Image.Image) -> Image.Image:
+    longest = max(img.size)
+    if longest <= WORKING_MAX_SIDE:
+        return img
+    scale = WORKING_MAX_SIDE / longest
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.BOX)
+
+
+def _moments(counts: np.ndarray):
+    # mean/std from a histogram of small non-negative integers, exact and O(bins)
+    values = np.arange(counts.size, dtype=np.float64)
+    n = counts.sum()
+    mean = counts @ values / n
+    var = counts @ np.square(values - mean) / n
+    return mean, float(np.sqrt(var))
+
+
+def check_quality(img: Image.Image) -> dict:
+    """Raise ValueError if ``img`` does not look like a usable scalp photo.
+
+    Checks run cheapest-first and stop at the first failure. Everything is
+    computed on uint8/int16 data from a bounded working copy, with moments
+    taken from histograms instead of float64 copies of the image.
+    """
+    arr = np.asarray(working_image(img))
+    stats = {}
+
+    channel_std = [
+        _moments(np.bincount(arr[..., c].ravel(), minlength=256))[1]
+        for c in range(3)
+    ]
+    stats["color_std"] = float(np.mean(channel_std))
+    if stats["color_std"] < MIN_COLOR_STD:
+        raise reject("color_variation", "Gambar bukan citra kulit kepala yang valid")
+
+    # 3 * gray as exact integers; the /3 is applied to the statistics instead
+    gray3 = arr.sum(axis=2, dtype=np.int16)
+    mean3, std3 = _moments(np.bincount(gray3.ravel(), minlength=766))
+    stats["brightness"] = mean3 / 3
+    stats["contrast"] = std3 / 3
+
+    if stats["brightness"] < MIN_BRIGHTNESS:
+        raise reject("too_dark", "Gambar terlalu gelap dan tidak terdeteksi sebagai kulit kepala")
+
+    if stats["contrast"] < MIN_CONTRAST:
+        raise reject("too_flat", "Gambar terlalu polos dan bukan citra kulit kepala")
+
+    gx = np.abs(np.diff(gray3, axis=1)).mean(dtype=np.float64)
+    gy = np.abs(np.diff(gray3, axis=0)).mean(dtype=np.float64)
+    stats["edge_strength"] = (gx + gy) / 3
+    if stats["edge_strength"] < MIN_EDGE_STRENGTH:
+        raise reject("no_hair_texture", "Gambar Tidak ditemukan tekstur rambut")
+
+    d2 = np.diff(gray3, 2, axis=1)
+    _, std_d2 = _moments(np.bincount((d2 + 1530).ravel(), minlength=3061))
+    stats["laplacian"] = (std_d2 / 3) ** 2
+    if stats["laplacian"] < MIN_LAPLACIAN:
+        raise reject("blurry", "Gambar terlalu halus / blur")
+
+    r = arr[..., 0]
+    g = arr[..., 1]
+    b = arr[..., 2]
+    spread = arr.max(axis=2) - arr.min(axis=2)
+    skin_mask = (r > 95) & (g > 40) & (b > 20) & (spread > 15) & \
+                (r.astype(np.int16) - g > 15) & (r > b)
+    stats["skin_ratio"] = np.count_nonzero(skin_mask) / skin_mask.size
+    if stats["skin_ratio"] < MIN_SKIN_RATIO:
+        raise reject("no_skin", "Gambar tidak terdeteksi warna kulit kepala")
+
+    return stats
@@ -0,0 +1,190 @@
+import glob
+import json
+import os
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(BASE_DIR, "model"))
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "fp32")
+
+# built-in variants; model/variants.json can add more or override these
+VARIANTS = {
+    "fp32": ("vgg16_final.tflite", "float32 weights and activations"),
+    "fp16": ("vgg16_final_fp16.tflite", "float16 weights, float32 compute"),
+    "dynamic": ("vgg16_final_dynamic.tflite", "int8 weights, dynamic-range activations"),
+    "int8": ("vgg16_final_int8.tflite", "full integer, int8 input and output"),
+}
+
+
+@dataclass
+class ModelVariant:
+    """One model file plus what the pipeline must know to feed it.
+
+    The tensor metadata is read from the interpreter by ``inspect``;
+    ``quantize`` and ``dequantize`` are identities for float tensors.
+    """
+    name: str
+    path: str
+    description: str = ""
+    input_dtype: type = np.float32
+    input_scale: float = 0.0
+    input_zero_point: int = 0
+    output_dtype: type = np.float32
+    output_scale: float = 0.0
+    output_zero_point: int = 0
+    # width of the penultimate-layer output, for models converted with one
+    embedding_dim: int = 0
+
+    def inspect(self, interpreter):
+        inp = interpreter.get_input_details()[0]
+        out, embedding = split_outputs(interpreter)
+        self.input_dtype = inp["dtype"]
+        self.input_scale, self.input_zero_point = inp["quantization"]
+        self.output_dtype = out["dtype"]
+        self.output_scale, self.output_zero_point = out["quantization"]
+        self.embedding_dim = int(embedding["shape"][-1]) if embedding is not None else 0
+        return self
+
+    @property
+    def quantized(self) -> bool:
+        return np.issubdtype(self.input_dtype, np.integer)
+
+    def quantize(self, x: np.ndarray) -> np.ndarray:
+        if not np.issubdtype(self.input_dtype, np.integer):
+            return x.astype(self.input_dtype)
+        info = np.iinfo(self.input_dtype)
+        q = np.round(x / self.input_scale) + self.input_zero_point
+        return np.clip(q, info.min, info.max).astype(self.input_dtype)
+
+    def dequantize(self, y: np.ndarray) -> np.ndarray:
+        if not np.issubdtype(self.output_dtype, np.integer) or not self.output_scale:
+            return y.astype(np.float32)
+        return (y.astype(np.float32) - self.output_zero_point) * self.output_scale
+
+    def metadata(self) -> dict:
+        return {
+            "name": self.name,
+            "file": os.path.basename(self.path),
+            "description": self.description,
+            "size_bytes": os.path.getsize(self.path),
+            "input_dtype": np.dtype(self.input_dtype).name,
+            "input_quantization": [self.input_scale, self.input_zero_point],
+            "output_dtype": np.dtype(self.output_dtype).name,
+            "output_quantization": [self.output_scale, self.output_zero_point],
+            "embedding_dim": self.embedding_dim,
+        }
+
+
+def split_outputs(interpreter):
+    """The class-score output of a model and its embedding output, or None.
+
+    Models converted with ``embeddings=True`` have a second output carrying
+    the classifier's input features; it is always wider than the scores.
+    """
+    outputs = sorted(interpreter.get_output_details(), key=lambda d: d["shape"][-1])
+    return outputs[0], (outputs[-1] if len(outputs) > 1 else None)
+
+
+def _manifest(model_dir):
+    entries = {name: {"file": f, "description": d} for name, (f, d) in VARIANTS.items()}
+    path = os.path.join(model_dir, "variants.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            for name, entry in json.load(f).items():
+                entries[name] = {**entries.get(name, {}), **entry}
+    return entries
+
+
+def available_variants(model_dir: str = MODEL_DIR) -> dict:
+    """Variants whose model file is present, by name."""
+    variants = {}
+    for name, entry in _manifest(model_dir).items():
+        path = os.path.join(model_dir, entry["file"])
+        if os.path.exists(path):
+            variants[name] = ModelVariant(name, path, entry.get("description", ""))
+    return variants
+
+
+def get_variant(name: str = MODEL_VARIANT, model_dir: str = MODEL_DIR) -> ModelVariant:
+    variants = available_variants(model_dir)
+    if name not in variants:
+        known = ", ".join(sorted(variants)) or "none"
+        raise ValueError(f"model variant {name!r} not found in {model_dir} (available: {known})")
+    return variants[name]
+
+
+def convert(source: str, calibration_dir: str, model_dir: str = MODEL_DIR, samples: int = 200,
+            embeddings: bool = False):
+    """Write every built-in variant from a Keras model file or SavedModel dir.
+
+    The full-int8 variant is calibrated on images from ``calibration_dir``,
+    preprocessed exactly like production inputs. With ``embeddings`` the
+    input of the final layer becomes a second model output (Keras files
+    only), for the similar-case index.
+    """
+    import tensorflow as tf
+
+    from app.ml.decode import decode_image
+    from app.ml.hair_classification import normalize
+
+    paths = sorted(
+        p for p in glob.glob(os.path.join(calibration_dir, "**", "*"), recursive=True)
+        if os.path.splitext(p)[1].lower() in (".jpg", ".jpeg", ".png", ".webp")
+    )[:samples]
+    if not paths:
+        raise ValueError(f"no calibration images in {calibration_dir}")
+
+    def representative_dataset():
+        for path in paths:
+            with open(path, "rb") as f:
+                img, _ = decode_image(f.read())
+            yield [normalize(img)]
+
+    if embeddings and os.path.isdir(source):
+        raise ValueError("embedding outputs need a Keras model file, not a SavedModel")
+
+    def converter():
+        if os.path.isdir(source):
+            return tf.lite.TFLiteConverter.from_saved_model(source)
+        model = tf.keras.models.load_model(source)
+        if embeddings:
+            model = tf.keras.Model(model.inputs, [model.outputs[0], model.layers[-1].input])
+        return tf.lite.TFLiteConverter.from_keras_model(model)
+
+    def fp16(c):
+        c.optimizations = [tf.lite.Optimize.DEFAULT]
+        c.target_spec.supported_types = [tf.float16]
+
+    def dynamic(c):
+        c.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    def int8(c):
+        c.optimizations = [tf.lite.Optimize.DEFAULT]
+        c.representative_dataset = representative_dataset
+        c.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        c.inference_input_type = tf.int8
+        c.inference_output_type = tf.int8
+
+    for name, configure in (("fp32", None), ("fp16", fp16), ("dynamic", dynamic), ("int8", int8)):
+        c = converter()
+        if configure:
+            configure(c)
+        path = os.path.join(model_dir, VARIANTS[name][0])
+        with open(path, "wb") as f:
+            f.write(c.convert())
+        print(f"{name:8} {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "list":
+        for variant in available_variants().values():
+            print(f"{variant.name:8} {os.path.basename(variant.path):32} {variant.description}")
+    elif len(sys.argv) in (4, 5) and sys.argv[1] == "convert" and sys.argv[4:] in ([], ["--embeddings"]):
+        convert(sys.argv[2], sys.argv[3], embeddings=len(sys.argv) == 5)
+    else:
+        sys.exit("usage: python -m app.ml.registry list\n"
+                 "       python -m app.ml.registry convert <keras_model|saved_model_dir> <calibration_dir>"
+                 " [--embeddings]")
@@ -0,0 +1,68 @@
+import importlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# "auto" picks the first runtime that imports; full TensorFlow is the fallback
+TFLITE_RUNTIME = os.getenv("TFLITE_RUNTIME", "auto")
+XNNPACK = os.getenv("TFLITE_XNNPACK", "1").lower() in ("1", "true", "yes")
+
+# module, Interpreter attribute, OpResolverType attribute
+_RUNTIMES = {
+    "tflite_runtime": ("tflite_runtime.interpreter", "Interpreter", "OpResolverType"),
+    "ai_edge_litert": ("ai_edge_litert.interpreter", "Interpreter", "OpResolverType"),
+    "tensorflow": ("tensorflow", "lite.Interpreter", "lite.experimental.OpResolverType"),
+}
+
+_resolved = None
+
+
+def _attr(obj, dotted):
+    for part in dotted.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+def _load(name):
+    module_name, interpreter, resolver = _RUNTIMES[name]
+    module = importlib.import_module(module_name)
+    return _attr(module, interpreter), _attr(module, resolver)
+
+
+def _resolve():
+    global _resolved
+    if _resolved is not None:
+        return _resolved
+
+    if TFLITE_RUNTIME != "auto" and TFLITE_RUNTIME not in _RUNTIMES:
+        raise ValueError(f"unknown TFLITE_RUNTIME {TFLITE_RUNTIME!r}")
+    names = list(_RUNTIMES) if TFLITE_RUNTIME == "auto" else [TFLITE_RUNTIME]
+    for name in names:
+        try:
+            _resolved = (name, *_load(name))
+        except ImportError:
+            continue
+        logger.info("using TFLite runtime %s", name)
+        return _resolved
+    raise ImportError(f"no TFLite runtime available (tried {', '.join(names)})")
+
+
+def interpreter_class():
+    """Return ``(runtime name, Interpreter class)``, importing it on first use.
+
+    The standalone runtimes are a few MB against several hundred for
+    TensorFlow, so importing the app stays cheap and only the process that
+    actually loads a model pays for the runtime.
+    """
+    name, Interpreter, _ = _resolve()
+    return name, Interpreter
+
+
+def make_interpreter(model_path: str, num_threads: int, xnnpack: bool = XNNPACK):
+    """Create an Interpreter; ``xnnpack=False`` runs the plain builtin kernels."""
+    _, Interpreter, OpResolverType = _resolve()
+    kwargs = {}
+    if not xnnpack:
+        kwargs["experimental_op_resolver_type"] = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    return Interpreter(model_path=model_path, num_threads=num_threads, **kwargs)
@@ -0,0 +1,324 @@
+"""Inference sidecar: one process owns the model for every web worker on a host.
+
+    python -m app.ml.sidecar [--socket PATH]
+
+Web workers started with ``INFERENCE_SIDECAR_SOCKET`` pointing at the same
+path do not load an interpreter; ``load_model()`` connects a
+``SidecarClient`` in place of the local ``BatchingEngine`` and ``predict()``
+works unchanged. Decoding and the quality gate still run in the web
+worker; only model inputs cross over, and requests from all workers are
+batched together here.
+
+Each client allocates a shared memory segment split into input-sized
+slots and writes its tensors there. The socket carries only small
+fixed-size headers one way and the output scores the other, so an image
+is never pickled or copied through the kernel.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_SOCKET = os.getenv("INFERENCE_SIDECAR_SOCKET", "")
+SIDECAR_SLOTS = int(os.getenv("INFERENCE_SIDECAR_SLOTS", "16"))
+SIDECAR_CONNECT_TIMEOUT = float(os.getenv("INFERENCE_SIDECAR_CONNECT_TIMEOUT", "60"))
+
+# request: id, slot; response: id, ok flag, payload length, then the payload
+_REQUEST = struct.Struct("<QI")
+_RESPONSE = struct.Struct("<QBI")
+_LENGTH = struct.Struct("<I")
+
+
+def _recv_exact(sock, n: int) -> bytes | None:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+def _send_json(sock, obj):
+    data = json.dumps(obj).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv_json(sock):
+    head = _recv_exact(sock, _LENGTH.size)
+    if head is None:
+        raise ConnectionError("inference sidecar closed the connection")
+    return json.loads(_recv_exact(sock, _LENGTH.unpack(head)[0]))
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # the client owns the segment; keep our resource tracker from unlinking it when we exit
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """One web worker connection: read slot requests, answer as batches finish."""
+
+    def handle(self):
+        from app.ml import embeddings, hair_classification as hc
+
+        sock = self.request
+        detail = hc.input_details[0]
+        _send_json(sock, {
+            "model_version": hc.MODEL_VERSION,
+            "runtime": hc.runtime,
+            "variant": {**hc.variant.metadata(), "path": hc.variant.path},
+            "labels": hc.labels,
+            "embeddings": embeddings.index is not None,
+            "input_shape": [int(d) for d in detail["shape"][1:]],
+        })
+        hello = _recv_json(sock)
+        shm = _attach(hello["shm"])
+        slots = np.ndarray(
+            (hello["slots"], *detail["shape"][1:]), dtype=detail["dtype"], buffer=shm.buf
+        )
+        send_lock = threading.Lock()
+        outstanding = set()
+
+        def send(req_id, ok, payload):
+            try:
+                with send_lock:
+                    sock.sendall(_RESPONSE.pack(req_id, ok, len(payload)) + payload)
+            except OSError:
+                pass  # the client went away; its pending requests fail on its side
+
+        def reply(req_id, fut):
+            outstanding.discard(fut)
+            try:
+                send(req_id, 1, np.asarray(fut.result(), dtype=np.float32).tobytes())
+            except Exception as e:
+                send(req_id, 0, f"{type(e).__name__}: {e}".encode())
+
+        try:
+            while (header := _recv_exact(sock, _REQUEST.size)) is not None:
+                req_id, slot = _REQUEST.unpack(header)
+                if slot >= len(slots):
+                    # never index shared memory with a slot the client made up
+                    send(req_id, 0, f"ValueError: no slot {slot} of {len(slots)}".encode())
+                    continue
+                # copied out so the batch never holds a view into the client's memory
+                fut = hc.engine.submit(slots[slot:slot + 1].copy())
+                outstanding.add(fut)
+                fut.add_done_callback(lambda f, req_id=req_id: reply(req_id, f))
+        except OSError:
+            pass
+        finally:
+            wait(list(outstanding))
+            del slots
+            shm.close()
+
+
+class SidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path: str = SIDECAR_SOCKET, stop: threading.Event | None = None):
+    """Load the model locally and answer web workers on ``path`` until ``stop`` is set."""
+    from app.ml import hair_classification
+
+    if not path:
+        raise ValueError("no socket path; set INFERENCE_SIDECAR_SOCKET or pass --socket")
+    hair_classification.load_model(sidecar=None)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = SidecarServer(path, _Handler)
+    thread = threading.Thread(target=server.serve_forever, name="sidecar", daemon=True)
+    thread.start()
+    logger.info("inference sidecar listening on %s", path)
+    try:
+        (stop or threading.Event()).wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.unlink(path)
+        hair_classification.unload_model()
+
+
+class SidecarClient:
+    """Drop-in for ``BatchingEngine`` that forwards inputs to the sidecar.
+
+    ``submit`` never blocks: when every slot is taken the request waits in
+    a local backlog and is sent as soon as a slot comes back. If the
+    sidecar goes away, pending requests fail and the next ``submit``
+    reconnects.
+    """
+
+    def __init__(self, path: str = SIDECAR_SOCKET, slots: int = SIDECAR_SLOTS,
+                 connect_timeout: float = SIDECAR_CONNECT_TIMEOUT):
+        self.path = path
+        self.slot_count = max(1, slots)
+        self.connect_timeout = connect_timeout
+        self.metadata = None
+        self._shm = None
+        self._slots = None
+        self._sock = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._free = deque()
+        self._backlog = deque()
+        self._pending = {}
+
+    def connect(self) -> dict:
+        """Connect and handshake, waiting up to ``connect_timeout`` for the sidecar to come up."""
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                with self._lock:
+                    return self._connect()
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            metadata = _recv_json(sock)
+            if self._shm is None:
+                shape = (self.slot_count, *metadata["input_shape"])
+                dtype = np.dtype(metadata["variant"]["input_dtype"])
+                self._shm = shared_memory.SharedMemory(
+                    create=True, size=int(np.prod(shape)) * dtype.itemsize
+                )
+                self._slots = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+            _send_json(sock, {"shm": self._shm.name, "slots": self.slot_count})
+        except BaseException:
+            sock.close()
+            raise
+
+        if self.metadata and metadata["model_version"] != self.metadata["model_version"]:
+            logger.warning("inference sidecar now serves model %s, this worker was started with %s",
+                           metadata["model_version"], self.metadata["model_version"])
+        self.metadata = metadata
+        self._sock = sock
+        self._free = deque(range(self.slot_count))
+        threading.Thread(target=self._read, args=(sock,), name="sidecar-reader", daemon=True).start()
+        return metadata
+
+    def submit(self, x: np.ndarray) -> Future:
+        fut = Future()
+        with self._lock:
+            if self._sock is None:
+                try:
+                    self._connect()
+                except OSError as e:
+                    fut.set_exception(ConnectionError(f"inference sidecar unavailable: {e}"))
+                    return fut
+            self._backlog.append((x, fut))
+            sock = self._sock
+            try:
+                self._drain()
+                return fut
+            except OSError:
+                pass
+        self._disconnected(sock)
+        return fut
+
+    def submit_many(self, xs: np.ndarray) -> Future:
+        # rows go over one by one; the sidecar batches them back together
+        combined = Future()
+        rows = [self.submit(xs[i:i + 1]) for i in range(len(xs))]
+
+        def done(_):
+            if combined.done() or not all(r.done() for r in rows):
+                return
+            try:
+                combined.set_result(np.stack([r.result() for r in rows]))
+            except Exception as e:
+                combined.set_exception(e)
+
+        for row in rows:
+            row.add_done_callback(done)
+        return combined
+
+    def _drain(self):
+        # caller holds the lock
+        while self._backlog and self._free:
+            x, fut = self._backlog.popleft()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            slot = self._free.popleft()
+            self._slots[slot] = x[0]
+            req_id = next(self._ids)
+            self._pending[req_id] = (slot, fut)
+            self._sock.sendall(_REQUEST.pack(req_id, slot))
+
+    def _read(self, sock):
+        try:
+            while (header := _recv_exact(sock, _RESPONSE.size)) is not None:
+                req_id, ok, length = _RESPONSE.unpack(header)
+                payload = _recv_exact(sock, length) if length else b""
+                with self._lock:
+                    slot, fut = self._pending.pop(req_id)
+                    self._free.append(slot)
+                if ok:
+                    fut.set_result(np.frombuffer(payload, dtype=np.float32))
+                else:
+                    fut.set_exception(RuntimeError(payload.decode()))
+                with self._lock:
+                    self._drain()
+        except OSError:
+            pass
+        self._disconnected(sock)
+
+    def _disconnected(self, sock):
+        with self._lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+            failed = [fut for _, fut in self._pending.values()]
+            failed += [fut for _, fut in self._backlog if fut.set_running_or_notify_cancel()]
+            self._pending.clear()
+            self._backlog.clear()
+        sock.close()
+        error = ConnectionError("inference sidecar connection lost")
+        for fut in failed:
+            fut.set_exception(error)
+
+    def close(self, timeout: float | None = None):
+        with self._lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+        if self._shm is not None:
+            self._slots = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=SIDECAR_SOCKET or "/tmp/scalp-inference.sock")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+    serve(args.socket, stop_event)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -26,9 +26,28 @@ class History(Base):
     confidence = Column(Float)
     image_path = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # MODEL_VERSION that produced disease/confidence; NULL for rows from before it was kept
+    model_version = Column(String(16))
 
     user = relationship("User", back_populates="histories")
 
+    __table_args__ = (
+        Index("ix_histories_user_created", "user_id", "created_at"),
+    )
+
+
+# per-user, per-disease totals of histories, kept current on every insert
+class DiagnosisSummary(Base):
+    __tablename__ = "diagnosis_summaries"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    disease = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+    last_confidence = Column(Float)
+    last_image_path = Column(String)
+    last_at = Column(DateTime)
+
 
 class PasswordReset(Base):
     __tablename__ = "password_resets"
@@ -39,3 +58,50 @@ class PasswordReset(Base):
     expired_at = Column(DateTime)
 
     user = relationship("User", back_populates="reset_codes")
+
+    __table_args__ = (
+        # the verify/reset lookup, and the per-user delete on its prefix
+        Index("ix_password_resets_user_code_expires", "user_id", "code", "expired_at"),
+        Index("ix_password_resets_expired_at", "expired_at"),
+    )
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+
+class PredictionJob(Base):
+    __tablename__ = "prediction_jobs"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    gender = Column(String, nullable=False, default="male")
+    image_path = Column(String, nullable=False)
+    digest = Column(String(64), nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    claimed_by = Column(String)
+    lease_expires_at = Column(DateTime)
+    result = Column(Text)
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_prediction_jobs_status_created", "status", "created_at"),
+    )
@@ -0,0 +1,232 @@
+"""Re-score stored uploads after a model change.
+
+    python -m app.rescore [--chunk 256] [--decoders N] [--checkpoint PATH] [--restart]
+
+Every History row whose ``model_version`` is not the loaded model's is
+read back from ``static/uploads``, run through the model and updated in
+place with the new label, confidence and version; its user's diagnosis
+summaries are recomputed in the same transaction.
+
+Rows are streamed in id order, ``--chunk`` at a time. Decoding and the
+quality gate run on a pool of processes while the previous chunk is in
+the model, and inference goes through the usual batching engine (or the
+inference sidecar). Images that are gone or that the current pipeline
+rejects keep their old result. The last committed id is checkpointed
+after every chunk, so an interrupted run resumes where it stopped;
+SIGINT/SIGTERM finish the current chunk first.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sqlalchemy import bindparam, or_, select, update
+
+from app.database import SessionLocal
+from app.migrations import run_migrations
+from app.models import History
+from app.utils.storage import local_path
+from app.utils.summaries import refresh_users
+
+logger = logging.getLogger(__name__)
+
+RESCORE_CHUNK_ROWS = int(os.getenv("RESCORE_CHUNK_ROWS", "256"))
+RESCORE_DECODERS = int(os.getenv("RESCORE_DECODERS", str(max(1, (os.cpu_count() or 1) // 2))))
+RESCORE_CHECKPOINT = os.getenv("RESCORE_CHECKPOINT", "rescore-checkpoint.json")
+
+COUNTERS = ("scored", "changed", "rejected", "missing")
+
+# set in each decoder process by _init_decoder
+_variant = None
+
+
+def _init_decoder(variant):
+    global _variant
+    # shutdown is driven by the parent, which finishes the chunk in hand
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _variant = variant
+
+
+def _decode(image_path: str):
+    # runs in a decoder process; returns (outcome, model input or message)
+    from app.ml.hair_classification import preprocess
+
+    try:
+        f = open(local_path(image_path), "rb")
+    except (OSError, ValueError) as e:
+        return "missing", str(e)
+    with f:
+        try:
+            return "ok", preprocess(f, _variant)
+        except ValueError as e:
+            return "rejected", str(e)
+
+
+def _make_pool(decoders: int, variant):
+    return ProcessPoolExecutor(
+        max_workers=decoders,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_decoder,
+        initargs=(variant,),
+    )
+
+
+def load_checkpoint(path: str, model_version: str) -> dict:
+    state = {"model_version": model_version, "last_id": 0, **dict.fromkeys(COUNTERS, 0)}
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return state
+    if saved.get("model_version") != model_version:
+        logger.info("checkpoint %s is for model %s; starting over", path, saved.get("model_version"))
+        return state
+    return {**state, **saved}
+
+
+def save_checkpoint(path: str, state: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _fetch(db, after_id: int, model_version: str, limit: int):
+    return db.execute(
+        select(History.id, History.user_id, History.disease, History.image_path)
+        .where(
+            History.id > after_id,
+            History.image_path.is_not(None),
+            or_(History.model_version.is_(None), History.model_version != model_version),
+        )
+        .order_by(History.id)
+        .limit(limit)
+    ).all()
+
+
+def _decode_chunk(pool, rows, decoders: int):
+    # map() submits everything up front; results come back in row order
+    chunksize = max(1, len(rows) // (decoders * 4))
+    return pool.map(_decode, [row.image_path for row in rows], chunksize=chunksize)
+
+
+def _score(rows, decoded, state: dict) -> list[dict]:
+    from app.ml import hair_classification as hc
+
+    inputs = []
+    for row, (outcome, value) in zip(rows, decoded):
+        if outcome == "ok":
+            inputs.append((row, value))
+        else:
+            state[outcome] += 1
+            logger.debug("history %d %s: %s", row.id, outcome, value)
+    if not inputs:
+        return []
+
+    # one submission per interpreter batch, so every inference worker gets a share
+    batch = hc.MAX_BATCH_SIZE
+    futures = [
+        hc.engine.submit_many(np.concatenate([x for _, x in inputs[i:i + batch]], axis=0))
+        for i in range(0, len(inputs), batch)
+    ]
+    probs = np.concatenate([fut.result() for fut in futures], axis=0)
+
+    updates = []
+    for (row, _), p in zip(inputs, probs):
+        try:
+            # the engine appends the embedding, if any, to the class scores
+            label, confidence, _ = hc.decide(p[:len(hc.labels)])
+        except ValueError:
+            state["rejected"] += 1
+            continue
+        state["scored"] += 1
+        state["changed"] += label != row.disease
+        updates.append({"row": row, "disease": label, "confidence": confidence})
+    return updates
+
+
+def _write(db, updates: list[dict], model_version: str):
+    table = History.__table__
+    db.execute(
+        update(table).where(table.c.id == bindparam("history_id")),
+        [{"history_id": u["row"].id, "disease": u["disease"], "confidence": u["confidence"],
+          "model_version": model_version} for u in updates],
+    )
+    refresh_users(db, [u["row"].user_id for u in updates])
+    db.commit()
+
+
+def rescore(chunk_rows: int = RESCORE_CHUNK_ROWS, decoders: int = RESCORE_DECODERS,
+            checkpoint: str = RESCORE_CHECKPOINT, restart: bool = False,
+            stop: threading.Event | None = None, session_factory=SessionLocal) -> dict:
+    """Re-score every History row from another model version; returns the run's counters."""
+    from app.ml import hair_classification as hc
+
+    stop = stop or threading.Event()
+    hc.load_model()
+    version = hc.MODEL_VERSION
+    state = load_checkpoint(checkpoint, version)
+    if restart:
+        state = {**state, "last_id": 0, **dict.fromkeys(COUNTERS, 0)}
+    start_counts = {name: state[name] for name in COUNTERS}
+    logger.info("re-scoring with model %s from id %d, %d decoder process(es)",
+                version, state["last_id"], decoders)
+
+    pool = _make_pool(decoders, hc.variant)
+    db = session_factory()
+    started = time.perf_counter()
+    images = 0
+    try:
+        rows = _fetch(db, state["last_id"], version, chunk_rows)
+        decoding = _decode_chunk(pool, rows, decoders)
+        while rows and not stop.is_set():
+            # the next chunk decodes while this one is in the model and written
+            next_rows = _fetch(db, rows[-1].id, version, chunk_rows)
+            next_decoding = _decode_chunk(pool, next_rows, decoders)
+
+            updates = _score(rows, decoding, state)
+            if updates:
+                _write(db, updates, version)
+            state["last_id"] = rows[-1].id
+            save_checkpoint(checkpoint, state)
+
+            images += len(rows)
+            elapsed = time.perf_counter() - started
+            logger.info("up to id %d: %d image(s), %.1f images/s, %d changed",
+                        state["last_id"], images, images / elapsed,
+                        state["changed"] - start_counts["changed"])
+            rows, decoding = next_rows, next_decoding
+    finally:
+        db.close()
+        pool.shutdown(wait=True, cancel_futures=True)
+        hc.unload_model()
+
+    elapsed = time.perf_counter() - started
+    result = {name: state[name] - start_counts[name] for name in COUNTERS}
+    result.update(images=images, seconds=round(elapsed, 2),
+                  images_per_second=round(images / elapsed, 1) if elapsed else 0.0,
+                  finished=not stop.is_set(), last_id=state["last_id"])
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk", type=int, default=RESCORE_CHUNK_ROWS)
+    parser.add_argument("--decoders", type=int, default=RESCORE_DECODERS)
+    parser.add_argument("--checkpoint", default=RESCORE_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    run_migrations()
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+    summary = rescore(args.chunk, max(1, args.decoders), args.checkpoint, args.restart, stop_event)
+    print(json.dumps(summary))
@@ -0,0 +1,45 @@
+import json
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+
+from app.auth import require_admin
+from app.utils.profiling import profiles, to_pstats, to_speedscope
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/profiles")
+def list_profiles():
+    """Captured request profiles, newest first; needs ``X-Admin-Token``."""
+    return {"items": profiles.list()}
+
+
+@router.get("/profiles/{profile_id}")
+def download_profile(
+    profile_id: str,
+    format: Literal["speedscope", "pstats"] = Query("speedscope"),
+):
+    """One profile as speedscope JSON (open in speedscope.app) or a pstats file.
+
+    ``python -m pstats <file>`` or snakeviz read the pstats download.
+    """
+    try:
+        meta, profile = profiles.load(profile_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Profil tidak ditemukan")
+
+    if format == "pstats":
+        if not profile["samples"]:
+            # pstats refuses to load an empty table
+            raise HTTPException(status_code=409, detail="Profil tidak memiliki sampel")
+        return Response(
+            to_pstats(profile),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.pstats"'},
+        )
+    return Response(
+        json.dumps(to_speedscope(meta, profile)),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'},
+    )
@@ -1,11 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime, timedelta
 from app.database import get_db
 from app.models import User, PasswordReset
-from app.auth import hash_password, verify_password, create_token, generate_reset_code
-from app.utils.email import send_reset_email
+from app.auth import (
+    hash_password_async, verify_password_async, needs_rehash,
+    create_token, generate_reset_code, CurrentUser, get_current_user
+)
+from app.utils.email import queue_reset_email, notify_outbox
 import re
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -50,14 +54,28 @@ def validate_password(password: str):
         raise HTTPException(status_code=400, detail="Password harus mengandung karakter khusus")
 
 
-@router.post("/register")
-def register(data: RegisterRequest, db: Session = Depends(get_db)):
+# register, login and reset-password are async so that bcrypt runs on its
+# own bounded executor (see app.auth) instead of holding a threadpool
+# thread; the short DB calls are pushed to the threadpool explicitly.
+
+def _check_new_user(db: Session, data: RegisterRequest):
     if db.query(User).filter(User.email == data.email).first():
         raise HTTPException(status_code=400, detail="Email sudah terdaftar")
 
     if db.query(User).filter(User.username == data.username).first():
         raise HTTPException(status_code=400, detail="Username sudah digunakan")
 
+
+def _add_user(db: Session, user: User):
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+
+
+@router.post("/register")
+async def register(data: RegisterRequest, db: Session = Depends(get_db)):
+    await run_in_threadpool(_check_new_user, db, data)
+
     validate_password(data.password)
 
     user = User(
@@ -65,28 +83,45 @@ def register(data: RegisterRequest, db: Session = Depends(get_db)):
         username=data.username,
         full_name=data.full_name,
         gender=data.gender,
-        hashed_password=hash_password(data.password)
+        hashed_password=await hash_password_async(data.password)
     )
 
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    await run_in_threadpool(_add_user, db, user)
 
     return {"message": "Register berhasil"}
 
 
+def _find_user(db: Session, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+
 @router.post("/login")
-def login(data: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == data.username).first()
+async def login(data: LoginRequest, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_find_user, db, data.username)
 
-    if not user or not verify_password(data.password, user.hashed_password):
+    if not user or not await verify_password_async(data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Username atau password salah")
 
+    if needs_rehash(user.hashed_password):
+        user.hashed_password = await hash_password_async(data.password)
+        await run_in_threadpool(db.commit)
+
     token = create_token({"user_id": user.id, "username": user.username})
 
     return {"access_token": token, "token_type": "bearer"}
 
 
+@router.get("/me")
+def me(user: CurrentUser = Depends(get_current_user)):
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "full_name": user.full_name,
+        "gender": user.gender
+    }
+
+
 @router.post("/forgot-password")
 def forgot_password(data: ForgotPasswordRequest, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.email == data.email).first()
@@ -108,12 +143,10 @@ def forgot_password(data: ForgotPasswordRequest, db: Session = Depends(get_db)):
     )
 
     db.add(reset)
+    # the email is committed with the code and sent by the outbox thread
+    queue_reset_email(db, user.email, code)
     db.commit()
-
-    try:
-        send_reset_email(user.email, code)
-    except Exception:
-        pass
+    notify_outbox()
 
     return {"message": "Kode reset dikirim"}
 
@@ -136,10 +169,7 @@ def verify_reset_code(data: VerifyResetCodeRequest, db: Session = Depends(get_db
     return {"message": "Kode valid"}
 
 
-@router.post("/reset-password")
-def reset_password(data: ResetPasswordRequest, db: Session = Depends(get_db)):
-    validate_password(data.new_password)
-
+def _find_reset(db: Session, data: ResetPasswordRequest):
     user = db.query(User).filter(User.email == data.email).first()
     if not user:
         raise HTTPException(status_code=404, detail="User tidak ditemukan")
@@ -153,8 +183,21 @@ def reset_password(data: ResetPasswordRequest, db: Session = Depends(get_db)):
     if not reset:
         raise HTTPException(status_code=400, detail="Kode tidak valid atau kadaluarsa")
 
-    user.hashed_password = hash_password(data.new_password)
+    return user, reset
+
+
+def _apply_reset(db: Session, user: User, reset: PasswordReset, hashed_password: str):
+    user.hashed_password = hashed_password
     db.delete(reset)
     db.commit()
 
+
+@router.post("/reset-password")
+async def reset_password(data: ResetPasswordRequest, db: Session = Depends(get_db)):
+    validate_password(data.new_password)
+
+    user, reset = await run_in_threadpool(_find_reset, db, data)
+    hashed_password = await hash_password_async(data.new_password)
+    await run_in_threadpool(_apply_reset, db, user, reset, hashed_password)
+
     return {"message": "Password berhasil diubah"}
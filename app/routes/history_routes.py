@@ -0,0 +1,126 @@
+import base64
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.auth import CurrentUser, get_current_user
+from app.database import get_db
+from app.ml.hair_classification import get_disease_info
+from app.models import History
+from app.utils.storage import thumbnail_url
+from app.utils.summaries import user_summary
+
+router = APIRouter(prefix="/history", tags=["History"])
+
+
+def encode_cursor(created_at: datetime, history_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{history_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, history_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(history_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor tidak valid")
+
+
+def history_item(history: History):
+    return {
+        "id": history.id,
+        "disease": history.disease,
+        "display_name": get_disease_info(history.disease)["display_name"],
+        "confidence": round(history.confidence * 100, 2),
+        "user_image": history.image_path,
+        "user_thumbnail": thumbnail_url(history.image_path),
+        "created_at": history.created_at,
+    }
+
+
+@router.get("")
+def list_history(
+    disease: str | None = Query(None),
+    date_from: datetime | None = Query(None),
+    date_to: datetime | None = Query(None),
+    cursor: str | None = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Newest-first history feed with keyset pagination on (created_at, id).
+
+    Pass the returned ``next_cursor`` back as ``cursor`` for the next page;
+    every page is an index range scan on (user_id, created_at), however
+    deep the client scrolls.
+    """
+    query = db.query(History).filter(History.user_id == user.id)
+
+    if disease:
+        query = query.filter(History.disease == disease)
+    if date_from:
+        query = query.filter(History.created_at >= date_from)
+    if date_to:
+        query = query.filter(History.created_at < date_to)
+
+    if cursor:
+        created_at, history_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            History.created_at < created_at,
+            and_(History.created_at == created_at, History.id < history_id)
+        ))
+
+    rows = query.order_by(
+        History.created_at.desc(), History.id.desc()
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    return {
+        "items": [history_item(h) for h in rows],
+        "next_cursor": next_cursor
+    }
+
+
+@router.get("/summary")
+def history_summary(
+    user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Per-disease counts, average confidence and the latest prediction.
+
+    Read from ``diagnosis_summaries``, one row per disease the user has
+    had, so the cost does not grow with the length of the history.
+    """
+    rows = user_summary(db, user.id)
+    latest = max(rows, key=lambda r: r.last_at, default=None)
+    if latest is not None:
+        latest = {
+            "disease": latest.disease,
+            "display_name": get_disease_info(latest.disease)["display_name"],
+            "confidence": round(latest.last_confidence * 100, 2),
+            "user_image": latest.last_image_path,
+            "user_thumbnail": thumbnail_url(latest.last_image_path),
+            "created_at": latest.last_at,
+        }
+
+    return {
+        "total": sum(r.count for r in rows),
+        "diseases": [
+            {
+                "disease": r.disease,
+                "display_name": get_disease_info(r.disease)["display_name"],
+                "count": r.count,
+                "average_confidence": round(r.confidence_sum / r.count * 100, 2),
+                "last_at": r.last_at,
+            }
+            for r in rows
+        ],
+        "latest": latest,
+    }
@@ -1,102 +1,309 @@
 from fastapi import APIRouter, UploadFile, File, Depends, Query, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Literal
-import uuid
+import asyncio
 import os
+import time
 
-from app.ml.hair_classification import predict, get_disease_info
+from app.auth import CurrentUser, get_current_user, get_optional_user
+from app.ml import embeddings, hair_classification
+from app.ml.hair_classification import is_ready, predict_async, predict_many_async, get_disease_info
 from app.database import get_db
-from app import models
+from app.utils.ingest import MAX_BATCH_FILES, Upload, is_zip, read_upload, read_zip
+from app.models import History, PredictionJob
+from app.routes.history_routes import history_item
+from app.utils.history_recorder import save_histories
+from app.utils.job_queue import TERMINAL, enqueue, job_view
+from app.utils.profiling import annotate_upload
+from app.utils.storage import UPLOAD_DIR, save_upload_async
 
 router = APIRouter(prefix="/predict", tags=["Predict"])
 
-UPLOAD_DIR = "static/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "heic", "heif"}
+JOB_MAX_WAIT = float(os.getenv("PREDICTION_JOB_MAX_WAIT", "30"))
+JOB_POLL_INTERVAL = 0.5
+
+ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "heic", "heif"}
+
+HEALTHY_MAP = {
+    "male": "/static/healthy/male.png",
+    "female": "/static/healthy/female.jpg"
+}
+
+PHOTO_TIPS = [
+    "Pastikan gambar fokus pada kulit kepala",
+    "Hindari gambar buram atau terlalu gelap",
+    "Pastikan tidak terhalang rambut atau aksesori"
+]
+
+
+def check_filename(filename: str | None):
+    if not filename:
+        raise ValueError("File tidak valid")
+
+    ext = filename.lower().split(".")[-1]
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ValueError("Format gambar tidak didukung")
+
+
+def prediction_result(label, confidence, status, stored, gender):
+    disease_info = get_disease_info(label)
+
+    warning = None
+    tips = None
+
+    if status == "low":
+        warning = "Prediksi kurang yakin, disarankan konsultasi dokter."
+        tips = PHOTO_TIPS
+
+    return {
+        "disease": label,
+        "display_name": disease_info["display_name"],
+        "confidence": round(confidence * 100, 2),
+        "user_image": stored.image_url,
+        "user_thumbnail": stored.thumbnail_url,
+        "healthy_reference": HEALTHY_MAP.get(gender),
+        "recommendations": disease_info["recommendation"],
+        "is_confident": status == "high",
+        "warning": warning,
+        "tips": tips
+    }
+
+
+def require_model():
+    if not is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail="Model sedang dimuat, coba lagi sebentar",
+            headers={"Retry-After": "5"}
+        )
+
+
+def rejection_result(message: str):
+    return {
+        "error": "Gambar yang diunggah kurang tepat",
+        "message": message,
+        "tips": PHOTO_TIPS
+    }
+
 
 @router.post("/")
 async def analyze(
     file: UploadFile = File(...),
     gender: Literal["male", "female"] = Query("male"),
-    user_id: int | None = Query(None),
+    user: CurrentUser | None = Depends(get_optional_user),
     db: Session = Depends(get_db),
 ):
+    # only a verified token ties the result to a user's history
+    user_id = user.id if user is not None else None
+    require_model()
 
     try:
-        if not file.filename:
-            raise ValueError("File tidak valid")
+        check_filename(file.filename)
 
-        ext = file.filename.lower().split(".")[-1]
-        if ext not in ALLOWED_EXTENSIONS:
-            raise ValueError("Format gambar tidak didukung")
+        upload = await read_upload(file)
+        annotate_upload(upload)
+        label, confidence, status = await predict_async(upload.file, upload.digest)
 
-        img_bytes = await file.read()
-        if not img_bytes:
-            raise ValueError("File gambar kosong")
+        stored = await save_upload_async(upload.file, upload.format, upload.digest)
 
-        label, confidence, status = predict(img_bytes)
-
-        filename = f"{uuid.uuid4()}.{ext}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        with open(file_path, "wb") as f:
-            f.write(img_bytes)
+        if user_id:
+            await run_in_threadpool(save_histories, db, [{
+                "user_id": user_id,
+                "disease": label,
+                "confidence": confidence,
+                "image_path": stored.image_url,
+                "model_version": hair_classification.MODEL_VERSION
+            }])
 
-        image_url = f"/static/uploads/{filename}"
+        return prediction_result(label, confidence, status, stored, gender)
 
-        if user_id:
-            history = models.History(
-                user_id=user_id,
-                disease=label,
-                confidence=confidence,
-                image_path=image_url
-            )
-            db.add(history)
-            db.commit()
-
-        healthy_map = {
-            "male": "/static/healthy/male.png",
-            "female": "/static/healthy/female.jpg"
-        }
-
-        disease_info = get_disease_info(label)
-
-        warning = None
-        tips = None
-
-        if status == "low":
-            warning = "Prediksi kurang yakin, disarankan konsultasi dokter."
-            tips = [
-                "Pastikan gambar fokus pada kulit kepala",
-                "Hindari gambar buram atau terlalu gelap",
-                "Pastikan tidak terhalang rambut atau aksesori"
-            ]
-
-        return {
-            "disease": label,
-            "display_name": disease_info["display_name"],
-            "confidence": round(confidence * 100, 2),
-            "user_image": image_url,
-            "healthy_reference": healthy_map.get(gender),
-            "recommendations": disease_info["recommendation"],
-            "is_confident": status == "high",
-            "warning": warning,
-            "tips": tips
-        }
+    except HTTPException:
+        raise
 
     except ValueError as e:
-        return {
-            "error": "Gambar yang diunggah kurang tepat",
-            "message": str(e),
-            "tips": [
-                "Pastikan gambar fokus pada kulit kepala",
-                "Hindari gambar buram atau terlalu gelap",
-                "Pastikan tidak terhalang rambut atau aksesori"
-            ]
-        }
+        return rejection_result(str(e))
 
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Terjadi kesalahan server: {str(e)}"
         )
+
+
+async def _collect_batch(files: list[UploadFile]):
+    items = []
+    for file in files:
+        try:
+            if await is_zip(file):
+                items.extend(await asyncio.to_thread(read_zip, file.file))
+                continue
+            check_filename(file.filename)
+            items.append((file.filename, await read_upload(file)))
+        except (ValueError, HTTPException) as e:
+            items.append((file.filename, e))
+    return items
+
+
+def _error_message(error: BaseException) -> str:
+    if isinstance(error, HTTPException):
+        return error.detail
+    if isinstance(error, ValueError):
+        return str(error)
+    return f"Terjadi kesalahan server: {str(error)}"
+
+
+@router.post("/batch")
+async def analyze_batch(
+    files: list[UploadFile] = File(...),
+    gender: Literal["male", "female"] = Query("male"),
+    user: CurrentUser | None = Depends(get_optional_user),
+    db: Session = Depends(get_db),
+):
+    """Analyze several photos at once, as multipart files or a zip archive.
+
+    Each image gets the same result (or error) object that ``/predict/``
+    returns, plus its filename. History rows are written in one commit.
+    """
+    user_id = user.id if user is not None else None
+    require_model()
+    items = await _collect_batch(files)
+    if not items:
+        raise HTTPException(status_code=400, detail="Tidak ada gambar yang diunggah")
+    if len(items) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Jumlah gambar melebihi batas {MAX_BATCH_FILES}"
+        )
+
+    uploads = [(i, upload) for i, (_, upload) in enumerate(items) if isinstance(upload, Upload)]
+    for _, upload in uploads:
+        annotate_upload(upload)
+    predictions = await predict_many_async(
+        [upload.file for _, upload in uploads],
+        [upload.digest for _, upload in uploads]
+    )
+
+    outcomes = {i: upload for i, (_, upload) in enumerate(items) if not isinstance(upload, Upload)}
+    accepted = []
+    for (i, upload), prediction in zip(uploads, predictions):
+        if isinstance(prediction, BaseException):
+            outcomes[i] = prediction
+        else:
+            accepted.append((i, upload, prediction))
+
+    stored_all = await asyncio.gather(
+        *[save_upload_async(upload.file, upload.format, upload.digest) for _, upload, _ in accepted]
+    )
+
+    histories = []
+    for (i, _, (label, confidence, status)), stored in zip(accepted, stored_all):
+        outcomes[i] = prediction_result(label, confidence, status, stored, gender)
+        if user_id:
+            histories.append({
+                "user_id": user_id,
+                "disease": label,
+                "confidence": confidence,
+                "image_path": stored.image_url,
+                "model_version": hair_classification.MODEL_VERSION
+            })
+
+    await run_in_threadpool(save_histories, db, histories)
+
+    results = []
+    for i, (filename, _) in enumerate(items):
+        outcome = outcomes[i]
+        if isinstance(outcome, BaseException):
+            outcome = rejection_result(_error_message(outcome))
+        results.append({"filename": filename, **outcome})
+
+    return {"results": results}
+
+
+@router.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    gender: Literal["male", "female"] = Query("male"),
+    user: CurrentUser | None = Depends(get_optional_user),
+    db: Session = Depends(get_db),
+):
+    """Store the upload and queue it for a worker; returns a job id to poll.
+
+    Jobs are run by ``python -m app.worker``. The upload checks happen
+    here, so an accepted job always points at a stored, sniffed image.
+    """
+    user_id = user.id if user is not None else None
+    try:
+        check_filename(file.filename)
+        upload = await read_upload(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stored = await save_upload_async(upload.file, upload.format, upload.digest)
+    job = await run_in_threadpool(enqueue, db, stored.image_url, upload.digest, gender, user_id)
+    return {"job_id": job.id, "status": job.status, "poll_url": f"/predict/jobs/{job.id}"}
+
+
+def _poll_job(db: Session, job_id: str):
+    job = db.query(PredictionJob).populate_existing().filter(PredictionJob.id == job_id).first()
+    view = (job.user_id, job_view(job)) if job else None
+    # end the read transaction so the next poll sees the worker's commit
+    db.rollback()
+    return view
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=JOB_MAX_WAIT),
+    user: CurrentUser | None = Depends(get_optional_user),
+    db: Session = Depends(get_db),
+):
+    """Current state of a job; with ``wait`` > 0, hold until it finishes or the wait runs out."""
+    deadline = time.monotonic() + wait
+    while True:
+        found = await run_in_threadpool(_poll_job, db, job_id)
+        # anonymous jobs are readable by anyone with the id, a user's only by them
+        if found is None or not (found[0] is None or (user is not None and found[0] == user.id)):
+            raise HTTPException(status_code=404, detail="Job tidak ditemukan")
+        view = found[1]
+        remaining = deadline - time.monotonic()
+        if view["status"] in TERMINAL or remaining <= 0:
+            return view
+        await asyncio.sleep(min(JOB_POLL_INTERVAL, remaining))
+
+
+@router.get("/similar/{history_id}")
+def similar_cases(
+    history_id: int,
+    k: int = Query(5, ge=1, le=50),
+    user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """The user's own past cases closest to ``history_id`` by model embedding."""
+    index = embeddings.index
+    if index is None:
+        raise HTTPException(status_code=503, detail="Pencarian kasus serupa tidak aktif")
+
+    history = db.get(History, history_id)
+    if history is None or history.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Riwayat tidak ditemukan")
+
+    vector = index.vector(history_id)
+    if vector is None:
+        raise HTTPException(status_code=404, detail="Riwayat ini belum memiliki embedding")
+
+    matches = index.search(vector, k, user_id=user.id, exclude=(history_id,))
+    rows = {
+        h.id: h for h in
+        db.query(History).filter(History.id.in_([i for i, _ in matches])).all()
+    }
+    return {
+        "history_id": history_id,
+        "items": [
+            {**history_item(rows[i]), "similarity": round(score, 4)}
+            for i, score in matches if i in rows
+        ]
+    }
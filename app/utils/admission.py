@@ -0,0 +1,181 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+
+from starlette.responses import JSONResponse
+
+from app.utils import metrics
+
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", str(2 * (os.cpu_count() or 1))))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# how long a request may expect to queue before it is turned away instead
+ADMISSION_TARGET_WAIT = float(os.getenv("ADMISSION_TARGET_WAIT", "2"))
+# starting guess for the time a request holds its slot, until we have measured it
+ADMISSION_INITIAL_SERVICE_TIME = float(os.getenv("ADMISSION_INITIAL_SERVICE_TIME", "0.5"))
+ADMISSION_PATHS = tuple(
+    p for p in os.getenv("ADMISSION_PATHS", "/predict/,/predict/batch").split(",") if p
+)
+
+# relative budget in milliseconds the client is willing to wait for an answer
+DEADLINE_HEADER = b"x-request-deadline-ms"
+
+ADMISSIONS = metrics.Counter(
+    "scalp_admission_total",
+    "Requests seen by admission control, by outcome",
+    ("outcome",),
+)
+ADMISSION_WAIT = metrics.Histogram(
+    "scalp_admission_wait_seconds",
+    "Time admitted requests spent in the admission queue",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+ADMISSION_SLOTS = metrics.Gauge(
+    "scalp_admission_slots",
+    "Admission control slots in use and requests waiting for one",
+    ("state",),
+)
+
+
+class Shed(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """A concurrency limit with a bounded FIFO queue in front of it.
+
+    A request that would have to wait longer than ``target_wait`` (or past
+    its own deadline) is refused up front rather than queued, so the work
+    that is accepted still finishes in reasonable time. The expected wait
+    comes from the queue position and a moving average of how long
+    requests hold their slot. Lives on one event loop; no locking needed.
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 max_queue: int = ADMISSION_MAX_QUEUE,
+                 target_wait: float = ADMISSION_TARGET_WAIT,
+                 service_time: float = ADMISSION_INITIAL_SERVICE_TIME):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.target_wait = target_wait
+        self.service_time = service_time
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def expected_wait(self, position: int) -> float:
+        """Expected time until the request at ``position`` (1 = next) gets a slot."""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            return 0.0
+        return math.ceil(position / self.max_in_flight) * self.service_time
+
+    def observe(self, held: float):
+        # exponentially weighted, so the estimate follows load changes within seconds
+        self.service_time += 0.2 * (held - self.service_time)
+
+    async def acquire(self, deadline: float | None = None):
+        """Take a slot or raise ``Shed``; ``deadline`` is a ``time.monotonic()`` value."""
+        if deadline is not None and deadline <= time.monotonic():
+            raise Shed(503, "deadline", 0)
+        position = len(self._waiters) + 1
+        wait = self.expected_wait(position)
+        if wait == 0:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Shed(429, "queue_full", wait)
+        if wait > self.target_wait:
+            raise Shed(503, "over_target", wait)
+        if deadline is not None and time.monotonic() + wait + self.service_time > deadline:
+            raise Shed(503, "deadline", wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            raise Shed(503, "expired", self.expected_wait(len(self._waiters) + 1))
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter):
+        if waiter.done():
+            # the slot was handed over just as we gave up; pass it on
+            self.release()
+        else:
+            waiter.cancel()
+            self._waiters.remove(waiter)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # hand the slot straight to the next in line; in_flight is unchanged
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+def _deadline(scope) -> float | None:
+    value = dict(scope["headers"]).get(DEADLINE_HEADER)
+    try:
+        budget_ms = float(value)
+    except (TypeError, ValueError):
+        return None
+    return time.monotonic() + budget_ms / 1000
+
+
+class AdmissionMiddleware:
+    """Admission control for the synchronous prediction routes.
+
+    Sits in front of the body being read, so a shed request costs neither
+    an upload buffer nor a preprocessing slot. Clients may send
+    ``X-Request-Deadline-Ms`` with the time they are willing to wait; the
+    request is refused, or dropped from the queue, once it cannot be
+    answered within it.
+    """
+
+    def __init__(self, app, paths=ADMISSION_PATHS, controller: AdmissionController | None = None):
+        self.app = app
+        self.paths = set(paths)
+        self.controller = controller or AdmissionController()
+        ADMISSION_SLOTS.set_function(lambda: self.controller.in_flight, state="in_flight")
+        ADMISSION_SLOTS.set_function(lambda: self.controller.queued, state="queued")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.monotonic()
+        try:
+            await self.controller.acquire(_deadline(scope))
+        except Shed as e:
+            ADMISSIONS.inc(outcome=e.reason)
+            response = JSONResponse(
+                {"detail": "Server sedang sibuk, coba lagi sebentar"},
+                status_code=e.status_code,
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        admitted = time.monotonic()
+        ADMISSIONS.inc(outcome="admitted")
+        ADMISSION_WAIT.observe(admitted - arrived)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.observe(time.monotonic() - admitted)
+            self.controller.release()
@@ -1,21 +1,64 @@
+import logging
 import os
 import smtplib
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
 from email.message import EmailMessage
 
+from sqlalchemy import update
 
-def send_reset_email(to_email: str, code: str):
-    email_user = os.getenv("EMAIL_USER")
-    email_pass = os.getenv("EMAIL_PASS")
+from app.database import SessionLocal
+from app.models import EmailOutbox
+from app.utils import metrics
 
-    if not email_user or not email_pass:
-        raise RuntimeError("EMAIL_USER atau EMAIL_PASS tidak terbaca dari environment")
+logger = logging.getLogger(__name__)
 
-    msg = EmailMessage()
-    msg["Subject"] = "Permintaan Reset Password Apk Analisis Masalah Kulit Kepala"
-    msg["From"] = email_user
-    msg["To"] = to_email
-    msg.set_content(
-        f"""Halo Sobat Pengguna Analisis Masalah Kulit Kepala,
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# providers drop idle sessions after a few minutes; close ours before that
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+
+OUTBOX_SENDER = os.getenv("EMAIL_OUTBOX_SENDER", "1").lower() in ("1", "true", "yes")
+OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("EMAIL_OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF = float(os.getenv("EMAIL_OUTBOX_BACKOFF", "5"))
+OUTBOX_MAX_BACKOFF = 15 * 60
+# a claimed message is retried by another sender if not settled within this
+OUTBOX_LEASE = 5 * 60
+
+RESET_SUBJECT = "Permintaan Reset Password Apk Analisis Masalah Kulit Kepala"
+
+EMAILS_SENT = metrics.Counter(
+    "scalp_email_sent_total",
+    "Outbox emails accepted by the SMTP server",
+)
+EMAIL_FAILURES = metrics.Counter(
+    "scalp_email_failures_total",
+    "Outbox send attempts that failed, by outcome",
+    ("outcome",),
+)
+SMTP_CONNECTS = metrics.Counter(
+    "scalp_smtp_connections_total",
+    "SMTP sessions opened (connect, STARTTLS and login)",
+)
+EMAIL_SEND_SECONDS = metrics.Histogram(
+    "scalp_email_send_seconds",
+    "Time to hand one message to the SMTP server, including any reconnect",
+)
+EMAIL_DELAY_SECONDS = metrics.Histogram(
+    "scalp_email_delay_seconds",
+    "Time from queueing a message to the SMTP server accepting it",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+
+
+def reset_email_body(code: str) -> str:
+    return f"""Halo Sobat Pengguna Analisis Masalah Kulit Kepala,
 
 Kami menerima permintaan untuk melakukan reset password pada akun Anda.
 
@@ -31,12 +74,234 @@ Terima kasih atas kepercayaan Anda menggunakan layanan kami.
 Hormat,
 Owner Apk Analisis Kulit Kepala
 """
-    )
-
-    server = smtplib.SMTP("smtp.gmail.com", 587)
-    server.ehlo()
-    server.starttls()
-    server.ehlo()
-    server.login(email_user, email_pass)
-    server.send_message(msg)
-    server.quit()
+
+
+def queue_reset_email(db, to_email: str, code: str):
+    """Add a reset email to the outbox; it is sent once ``db`` commits."""
+    db.add(EmailOutbox(
+        to_email=to_email,
+        subject=RESET_SUBJECT,
+        body=reset_email_body(code),
+    ))
+
+
+class SMTPConnection:
+    """One authenticated SMTP session, opened on demand and reused.
+
+    A send on a session the server has dropped reconnects once and retries;
+    a session idle for longer than ``idle_timeout`` is closed first rather
+    than discovered dead mid-send.
+    """
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT,
+                 username: str | None = None, password: str | None = None,
+                 starttls: bool = SMTP_STARTTLS, timeout: float = SMTP_TIMEOUT,
+                 idle_timeout: float = SMTP_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        # credentials are read on connect, after .env has been loaded
+        self._username = username
+        self._password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._server = None
+        self._last_used = 0.0
+
+    @property
+    def username(self) -> str | None:
+        return self._username if self._username is not None else os.getenv("EMAIL_USER")
+
+    @property
+    def password(self) -> str | None:
+        return self._password if self._password is not None else os.getenv("EMAIL_PASS")
+
+    @property
+    def sender(self) -> str:
+        return self.username or f"noreply@{self.host}"
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls()
+                server.ehlo()
+            username, password = self.username, self.password
+            if username and password:
+                server.login(username, password)
+        except BaseException:
+            server.close()
+            raise
+        SMTP_CONNECTS.inc()
+        self._server = server
+
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+
+    def send(self, msg: EmailMessage):
+        self.close_if_idle()
+        try:
+            if self._server is None:
+                self._connect()
+            self._server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self._server = None
+            self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+
+def _backoff(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF)
+
+
+class OutboxSender:
+    """Background thread draining the ``email_outbox`` table.
+
+    Due messages are claimed in batches, each claim being a conditional
+    UPDATE so several web workers can run a sender against the same table
+    without sending a message twice. Everything goes out over one reused
+    SMTP session. Failures are retried with exponential backoff until
+    ``max_attempts``, after which the row is marked ``failed``; a sender
+    that dies mid-batch leaves its claims to expire after the lease.
+    """
+
+    def __init__(self, session_factory=SessionLocal, connection: SMTPConnection | None = None,
+                 batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.connection = connection or SMTPConnection()
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    def close(self, timeout: float | None = 10.0):
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.connection.close()
+
+    def _claim(self, db, now):
+        due = (
+            db.query(EmailOutbox.id, EmailOutbox.next_attempt_at)
+            .filter(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at)
+            .limit(self.batch_size)
+            .all()
+        )
+        lease = now + timedelta(seconds=OUTBOX_LEASE)
+        claimed = []
+        for row_id, seen in due:
+            result = db.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id == row_id, EmailOutbox.status == "pending",
+                       EmailOutbox.next_attempt_at == seen)
+                .values(next_attempt_at=lease, attempts=EmailOutbox.attempts + 1)
+            )
+            if result.rowcount == 1:
+                claimed.append(row_id)
+        db.commit()
+        if not claimed:
+            return []
+        return db.query(EmailOutbox).filter(EmailOutbox.id.in_(claimed)).all()
+
+    def _message(self, row):
+        msg = EmailMessage()
+        msg["Subject"] = row.subject
+        msg["From"] = self.connection.sender
+        msg["To"] = row.to_email
+        msg.set_content(row.body)
+        return msg
+
+    def send_due(self) -> int:
+        """Send one batch of due messages; returns how many were claimed."""
+        db = self.session_factory()
+        try:
+            rows = self._claim(db, datetime.utcnow())
+            for row in rows:
+                started = time.perf_counter()
+                try:
+                    self.connection.send(self._message(row))
+                except (smtplib.SMTPException, OSError) as e:
+                    self.connection.close()
+                    permanent = isinstance(e, smtplib.SMTPRecipientsRefused)
+                    if permanent or row.attempts >= self.max_attempts:
+                        row.status = "failed"
+                        EMAIL_FAILURES.inc(outcome="failed")
+                        logger.error("giving up on email %d to %s: %s", row.id, row.to_email, e)
+                    else:
+                        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=_backoff(row.attempts))
+                        EMAIL_FAILURES.inc(outcome="retry")
+                        logger.warning("email %d failed (attempt %d), retrying: %s",
+                                       row.id, row.attempts, e)
+                    row.last_error = str(e)[:500]
+                else:
+                    now = datetime.utcnow()
+                    row.status = "sent"
+                    row.sent_at = now
+                    row.last_error = None
+                    EMAILS_SENT.inc()
+                    EMAIL_SEND_SECONDS.observe(time.perf_counter() - started)
+                    EMAIL_DELAY_SECONDS.observe((now - row.created_at).total_seconds())
+                # settle each row as it goes so a crash cannot resend the batch
+                db.commit()
+            return len(rows)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._closed:
+            try:
+                claimed = self.send_due()
+            except Exception:
+                logger.exception("email outbox pass failed")
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            self.connection.close_if_idle()
+
+
+sender = OutboxSender() if OUTBOX_SENDER else None
+
+
+def notify_outbox():
+    if sender is not None:
+        sender.notify()
+
+
+if __name__ == "__main__":
+    # standalone sender, for deployments that set EMAIL_OUTBOX_SENDER=0 on the web workers
+    if sys.argv[1:] != ["run"]:
+        sys.exit("usage: python -m app.utils.email run")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    worker = OutboxSender().start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        worker.close()
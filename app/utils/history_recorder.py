@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app.database import SessionLocal
+from app.ml import embeddings
+from app.ml.instrumentation import STAGE_SECONDS
+from app.models import History
+from app.utils import metrics
+from app.utils.summaries import apply_histories
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+FLUSH_SIZE = int(os.getenv("HISTORY_FLUSH_SIZE", "100"))
+FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+# failed flushes of the same rows before they are written one at a time
+FLUSH_MAX_ATTEMPTS = int(os.getenv("HISTORY_FLUSH_MAX_ATTEMPTS", "5"))
+# one parameter per column and row keeps an INSERT under the 999 bound
+# parameters older SQLite builds allow
+ROWS_PER_STATEMENT = 999 // len(History.__table__.columns)
+
+PENDING = metrics.Gauge(
+    "scalp_history_pending_rows",
+    "History rows queued in the write-behind recorder",
+)
+FLUSH_ROWS = metrics.Histogram(
+    "scalp_history_flush_rows",
+    "Rows written per write-behind flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+FLUSH_SECONDS = metrics.Histogram(
+    "scalp_history_flush_seconds",
+    "Duration of one write-behind flush, including commit",
+)
+FLUSH_ERRORS = metrics.Counter(
+    "scalp_history_flush_errors_total",
+    "Write-behind flushes that failed and were retried",
+)
+DROPPED_ROWS = metrics.Counter(
+    "scalp_history_dropped_rows_total",
+    "History rows dropped after failing on their own",
+)
+
+
+def _index_embeddings(ids, rows):
+    # the History rows are committed; a failed append only loses similar-case search for them
+    try:
+        embeddings.index_histories(ids, rows)
+    except Exception:
+        logger.exception("embedding index append failed for %d row(s)", len(rows))
+
+
+class HistoryRecorder:
+    """Buffers History rows in memory and writes them in bulk.
+
+    A background thread flushes when ``flush_size`` rows are pending or
+    ``flush_interval`` seconds have passed, using multi-row INSERTs in a
+    single transaction together with the diagnosis summaries. Failed
+    flushes keep their rows and are retried; after ``max_attempts``
+    failures in a row the pending rows are written one per transaction,
+    and any row that still fails is logged and dropped, so one bad row
+    cannot hold up the rest. ``close()`` drains whatever is left.
+    """
+
+    def __init__(self, session_factory=SessionLocal, flush_size: int = FLUSH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, max_attempts: int = FLUSH_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.max_attempts = max(1, max_attempts)
+        self._failures = 0
+        self._rows = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="history-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, **values):
+        self.record_many([values])
+
+    def record_many(self, rows):
+        now = datetime.utcnow()
+        rows = [{"created_at": now, **row} for row in rows]
+        with self._cond:
+            self._rows.extend(rows)
+            PENDING.set(len(self._rows))
+            if len(self._rows) >= self.flush_size:
+                self._cond.notify()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+
+            started = time.perf_counter()
+            try:
+                ids = self._write(rows)
+            except Exception:
+                FLUSH_ERRORS.inc()
+                self._failures += 1
+                if self._failures < self.max_attempts:
+                    with self._cond:
+                        self._rows[:0] = rows
+                        PENDING.set(len(self._rows))
+                    raise
+                logger.exception("history flush failed %d times, writing %d row(s) one at a time",
+                                 self._failures, len(rows))
+                self._failures = 0
+                self._write_each(rows)
+            else:
+                self._failures = 0
+                FLUSH_ROWS.observe(len(rows))
+                FLUSH_SECONDS.observe(time.perf_counter() - started)
+                if ids:
+                    _index_embeddings(ids, rows)
+            with self._cond:
+                PENDING.set(len(self._rows))
+
+    def _write(self, rows):
+        # one transaction for the rows and their summaries; returns the new ids when they are needed
+        db = self.session_factory()
+        ids = None
+        try:
+            if embeddings.index is None:
+                for start in range(0, len(rows), ROWS_PER_STATEMENT):
+                    db.execute(insert(History).values(rows[start:start + ROWS_PER_STATEMENT]))
+            else:
+                # the embedding index needs the new ids, which a multi-row INSERT does not return
+                histories = [History(**row) for row in rows]
+                db.add_all(histories)
+                db.flush()
+                ids = [h.id for h in histories]
+            apply_histories(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return ids
+
+    def _write_each(self, rows):
+        for row in rows:
+            try:
+                ids = self._write([row])
+            except Exception:
+                DROPPED_ROWS.inc()
+                logger.exception("dropping history row %r", row)
+                continue
+            if ids:
+                _index_embeddings(ids, [row])
+
+    def close(self, timeout: float | None = 10.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("history flush failed on shutdown, %d row(s) lost", len(self._rows))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._rows) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("history flush failed, retrying in %.1fs", self.flush_interval)
+                if not closed:
+                    time.sleep(self.flush_interval)
+            if closed:
+                return
+
+
+recorder = HistoryRecorder() if WRITE_BEHIND else None
+
+
+def save_histories(db, rows):
+    """Persist History rows and their summaries, through the write-behind recorder when enabled."""
+    if not rows:
+        return
+    with STAGE_SECONDS.time(stage="history_commit"):
+        if recorder is not None:
+            recorder.record_many(rows)
+            return
+        now = datetime.utcnow()
+        rows = [{"created_at": now, **row} for row in rows]
+        histories = [History(**row) for row in rows]
+        db.add_all(histories)
+        db.flush()
+        ids = [h.id for h in histories]
+        apply_histories(db, rows)
+        db.commit()
+    if embeddings.index is not None:
+        _index_embeddings(ids, rows)
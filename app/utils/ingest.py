@@ -0,0 +1,191 @@
+import hashlib
+import io
+import os
+import zipfile
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+
+from app.ml.instrumentation import reject
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "20"))
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(100 * 1024 * 1024)))
+CHUNK_SIZE = 256 * 1024
+# multipart boundaries and headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+SUPPORTED_FORMATS = {"jpg", "png", "webp", "heic"}
+
+_HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+
+def sniff_format(head: bytes) -> str | None:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp" and head[8:12] in _HEIF_BRANDS:
+        return "heic"
+    return None
+
+
+def open_source(source) -> BinaryIO:
+    # images travel through the pipeline either as bytes or as a seekable file
+    if hasattr(source, "read"):
+        source.seek(0)
+        return source
+    return io.BytesIO(source)
+
+
+def _too_large(limit: int = MAX_UPLOAD_BYTES):
+    limit_mb = limit / (1024 * 1024)
+    return HTTPException(
+        status_code=413,
+        detail=f"Ukuran file melebihi batas {limit_mb:g} MB"
+    )
+
+
+@dataclass
+class Upload:
+    file: BinaryIO
+    digest: str
+    format: str
+    size: int
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> Upload:
+    """Hash and size-check an upload chunk by chunk, without buffering it.
+
+    The bytes stay in the upload's spooled temp file, which is handed on
+    to the decoder and the storage layer. The real format comes from the
+    magic bytes, not from the filename.
+    """
+    h = hashlib.sha256()
+    size = 0
+    head = b""
+    await file.seek(0)
+    while chunk := await file.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large()
+        if len(head) < 16:
+            head += chunk[:16]
+        h.update(chunk)
+
+    if not size:
+        raise reject("empty_file", "File gambar kosong")
+
+    fmt = sniff_format(head)
+    if fmt not in SUPPORTED_FORMATS:
+        raise reject("unsupported_format", "Format gambar tidak didukung")
+
+    await file.seek(0)
+    return Upload(file.file, h.hexdigest(), fmt, size)
+
+
+def upload_from_bytes(data: bytes, max_bytes: int = MAX_UPLOAD_BYTES) -> Upload:
+    if len(data) > max_bytes:
+        raise _too_large()
+    if not data:
+        raise reject("empty_file", "File gambar kosong")
+    fmt = sniff_format(data[:16])
+    if fmt not in SUPPORTED_FORMATS:
+        raise reject("unsupported_format", "Format gambar tidak didukung")
+    return Upload(io.BytesIO(data), hashlib.sha256(data).hexdigest(), fmt, len(data))
+
+
+async def is_zip(file: UploadFile) -> bool:
+    await file.seek(0)
+    head = await file.read(4)
+    await file.seek(0)
+    return head == b"PK\x03\x04"
+
+
+def read_zip(fileobj, max_files: int = MAX_BATCH_FILES):
+    """Unpack image members of a zip archive as ``(name, Upload | error)``.
+
+    Each member is size-checked against its declared and actual size, so a
+    compressed bomb cannot be inflated past MAX_UPLOAD_BYTES.
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ValueError("Arsip zip tidak valid")
+
+    with archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and not os.path.basename(info.filename).startswith(".")
+            and not info.filename.startswith("__MACOSX/")
+        ]
+        if len(members) > max_files:
+            raise ValueError(f"Jumlah gambar melebihi batas {max_files}")
+
+        items = []
+        for info in members:
+            try:
+                if info.file_size > MAX_UPLOAD_BYTES:
+                    raise _too_large()
+                with archive.open(info) as f:
+                    data = f.read(MAX_UPLOAD_BYTES + 1)
+                items.append((info.filename, upload_from_bytes(data)))
+            except (ValueError, HTTPException, zipfile.BadZipFile) as e:
+                items.append((info.filename, e))
+        return items
+
+
+class UploadLimitMiddleware:
+    """Reject oversized request bodies before they are parsed.
+
+    A declared Content-Length over the limit is answered with 413 at once;
+    otherwise the streamed body is counted and the request aborted as soon
+    as it passes the limit.
+    """
+
+    def __init__(self, app, limits=None):
+        self.app = app
+        limits = limits or {
+            "/predict/batch": MAX_BATCH_BYTES,
+            "/predict": MAX_UPLOAD_BYTES,
+        }
+        # most specific prefix wins
+        self.limits = sorted(limits.items(), key=lambda kv: len(kv[0]), reverse=True)
+
+    def _limit_for(self, path):
+        for prefix, max_bytes in self.limits:
+            if path.startswith(prefix):
+                return max_bytes
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit_for(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = limit + MULTIPART_OVERHEAD
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > max_bytes:
+            error = _too_large(limit)
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,154 @@
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+
+from app.models import History, PredictionJob
+from app.utils import metrics
+from app.utils.summaries import apply_histories
+
+JOB_LEASE = float(os.getenv("PREDICTION_JOB_LEASE", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("PREDICTION_JOB_MAX_ATTEMPTS", "3"))
+
+TERMINAL = ("done", "failed")
+
+JOBS_ENQUEUED = metrics.Counter(
+    "scalp_jobs_enqueued_total",
+    "Prediction jobs accepted by POST /predict/jobs",
+)
+JOBS_CLAIMED = metrics.Counter(
+    "scalp_jobs_claimed_total",
+    "Prediction jobs claimed by a worker, including retries",
+)
+JOBS_FINISHED = metrics.Counter(
+    "scalp_jobs_finished_total",
+    "Prediction jobs settled by a worker, by outcome",
+    ("outcome",),
+)
+JOB_LATENCY = metrics.Histogram(
+    "scalp_job_latency_seconds",
+    "Time from enqueue to a finished job",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+
+
+def enqueue(db, image_path: str, digest: str, gender: str, user_id: int | None) -> PredictionJob:
+    job = PredictionJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        gender=gender,
+        image_path=image_path,
+        digest=digest,
+        status="queued",
+    )
+    db.add(job)
+    db.commit()
+    JOBS_ENQUEUED.inc()
+    return job
+
+
+def claim(db, worker_id: str, limit: int) -> list[PredictionJob]:
+    """Claim up to ``limit`` runnable jobs for ``worker_id``.
+
+    Runnable means queued, or running under a lease that has expired (its
+    worker died). Each claim is a conditional UPDATE on the state that was
+    read, so of several workers racing for a job exactly one sees a row
+    count of 1; this needs nothing beyond what SQLite and Postgres both do.
+    """
+    now = datetime.utcnow()
+    runnable = or_(
+        PredictionJob.status == "queued",
+        and_(PredictionJob.status == "running", PredictionJob.lease_expires_at < now),
+    )
+    query = (
+        db.query(PredictionJob.id, PredictionJob.status, PredictionJob.attempts)
+        .filter(runnable)
+        .order_by(PredictionJob.created_at)
+        .limit(limit)
+    )
+    if db.bind.dialect.name == "postgresql":
+        # lets concurrent workers skip each other's rows instead of colliding
+        query = query.with_for_update(skip_locked=True)
+
+    lease = now + timedelta(seconds=JOB_LEASE)
+    claimed = []
+    for job_id, status, attempts in query.all():
+        result = db.execute(
+            update(PredictionJob)
+            .where(PredictionJob.id == job_id, PredictionJob.status == status,
+                   PredictionJob.attempts == attempts)
+            .values(status="running", claimed_by=worker_id, lease_expires_at=lease,
+                    attempts=attempts + 1)
+        )
+        if result.rowcount == 1:
+            claimed.append(job_id)
+    db.commit()
+    JOBS_CLAIMED.inc(len(claimed))
+    if not claimed:
+        return []
+    return (
+        db.query(PredictionJob)
+        .filter(PredictionJob.id.in_(claimed))
+        .order_by(PredictionJob.created_at)
+        .all()
+    )
+
+
+def _settle(db, job: PredictionJob, worker_id: str, values: dict, history: dict | None = None) -> bool:
+    # only the current claimant may settle; a worker whose lease ran out and
+    # whose job was re-claimed elsewhere loses here and writes nothing
+    result = db.execute(
+        update(PredictionJob)
+        .where(PredictionJob.id == job.id, PredictionJob.claimed_by == worker_id,
+               PredictionJob.status == "running")
+        .values(**values)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        return False
+    if history is not None:
+        history = {"created_at": datetime.utcnow(), **history}
+        db.add(History(**history))
+        apply_histories(db, [history])
+    db.commit()
+    return True
+
+
+def complete(db, job: PredictionJob, worker_id: str, result: dict, history: dict | None = None) -> bool:
+    """Store the job's result, and its History row in the same transaction."""
+    now = datetime.utcnow()
+    settled = _settle(db, job, worker_id, {
+        "status": "done", "result": json.dumps(result), "finished_at": now,
+        "lease_expires_at": None,
+    }, history)
+    if settled:
+        JOBS_FINISHED.inc(outcome="done")
+        JOB_LATENCY.observe((now - job.created_at).total_seconds())
+    return settled
+
+
+def retry_or_fail(db, job: PredictionJob, worker_id: str, error: str) -> bool:
+    """Put a job that crashed back in the queue, or fail it after the last attempt."""
+    if job.attempts >= JOB_MAX_ATTEMPTS:
+        values = {"status": "failed", "error": error[:500], "finished_at": datetime.utcnow(),
+                  "lease_expires_at": None}
+    else:
+        values = {"status": "queued", "error": error[:500], "claimed_by": None,
+                  "lease_expires_at": None}
+    settled = _settle(db, job, worker_id, values)
+    if settled:
+        JOBS_FINISHED.inc(outcome=values["status"])
+    return settled
+
+
+def job_view(job: PredictionJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error if job.status == "failed" else None,
+    }
@@ -0,0 +1,115 @@
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from app.database import SessionLocal
+from app.models import EmailOutbox, PasswordReset
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+RESET_PURGE = os.getenv("RESET_PURGE", "1").lower() in ("1", "true", "yes")
+RESET_PURGE_INTERVAL = float(os.getenv("RESET_PURGE_INTERVAL", "3600"))
+# settled outbox rows hold reset codes in plain text; keep them only this long
+OUTBOX_RETENTION_HOURS = float(os.getenv("EMAIL_OUTBOX_RETENTION_HOURS", "24"))
+
+RESETS_PURGED = metrics.Counter(
+    "scalp_password_resets_purged_total",
+    "Expired password reset codes deleted by the purge job",
+)
+OUTBOX_PURGED = metrics.Counter(
+    "scalp_email_outbox_purged_total",
+    "Sent and failed outbox emails deleted by the purge job",
+)
+
+
+def purge_expired_resets(db, now: datetime | None = None) -> int:
+    """Delete reset codes that have expired; returns how many went."""
+    deleted = (
+        db.query(PasswordReset)
+        .filter(PasswordReset.expired_at <= (now or datetime.utcnow()))
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    RESETS_PURGED.inc(deleted)
+    return deleted
+
+
+def purge_settled_emails(db, now: datetime | None = None,
+                         retention_hours: float = OUTBOX_RETENTION_HOURS) -> int:
+    """Delete outbox emails sent or failed over ``retention_hours`` ago; returns how many went."""
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=retention_hours)
+    # a settled row's next_attempt_at is the lease of its last attempt,
+    # which also lets the (status, next_attempt_at) index find them
+    deleted = (
+        db.query(EmailOutbox)
+        .filter(EmailOutbox.status.in_(("sent", "failed")), EmailOutbox.next_attempt_at <= cutoff)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    OUTBOX_PURGED.inc(deleted)
+    return deleted
+
+
+class ResetPurger:
+    """Background thread deleting stale reset codes every ``interval`` seconds.
+
+    Runs ``purge_expired_resets`` and ``purge_settled_emails``: codes are
+    otherwise only removed when the same user asks for a new one or
+    completes a reset, and outbox rows that carried them never are. The
+    DELETEs are idempotent, so it does not matter how many web workers run
+    a purger against the same database.
+    """
+
+    def __init__(self, session_factory=SessionLocal, interval: float = RESET_PURGE_INTERVAL,
+                 retention_hours: float = OUTBOX_RETENTION_HOURS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.retention_hours = retention_hours
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="reset-purger", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, timeout: float | None = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def purge(self) -> tuple[int, int]:
+        """Returns the number of reset codes and of outbox emails deleted."""
+        db = self.session_factory()
+        try:
+            resets = purge_expired_resets(db)
+            return resets, purge_settled_emails(db, retention_hours=self.retention_hours)
+        finally:
+            db.close()
+
+    def _run(self):
+        while True:
+            try:
+                resets, emails = self.purge()
+                if resets or emails:
+                    logger.info("purged %d expired password reset code(s) and %d outbox email(s)",
+                                resets, emails)
+            except Exception:
+                logger.exception("password reset purge failed")
+            if self._stop.wait(self.interval):
+                return
+
+
+purger = ResetPurger() if RESET_PURGE else None
+
+
+if __name__ == "__main__":
+    # one-off purge, e.g. from cron when RESET_PURGE=0 on the web workers
+    if sys.argv[1:] != ["purge"]:
+        sys.exit("usage: python -m app.utils.maintenance purge")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    resets, emails = ResetPurger().purge()
+    print(f"purged {resets} expired password reset code(s) and {emails} outbox email(s)")
@@ -0,0 +1,467 @@
+"""Opt-in request profiling and slow-request capture.
+
+A request is profiled when it carries ``X-Profile: <ADMIN_TOKEN>``, when
+it is picked by ``PROFILE_SAMPLE_RATE``, or, with ``PROFILE_SLOW_MS`` set,
+always; in that last case the profile is only kept if the request turns
+out slower than the threshold. While any request is being profiled a
+sampler thread records, every ``PROFILE_INTERVAL_MS``, the Python stacks
+of the threads working for a profiled request: the event loop while it
+runs that request's coroutine, and threads running work the request
+handed off with ``bind()`` (preprocessing, file writes) or an inference
+batch holding one of its images. Each sample is tagged with the requests
+it belongs to, so concurrent requests stay apart; tasks a request spawns
+and threads it reaches without ``bind()`` are not followed.
+
+Profiles go to a bounded ring of files in ``PROFILE_DIR``, together with
+the size, format and dimensions of the uploaded images, and are served
+by ``/admin/profiles`` as speedscope JSON or a pstats file.
+"""
+import asyncio
+import contextlib
+import contextvars
+import gzip
+import json
+import logging
+import marshal
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+
+from PIL import Image
+
+from app.auth import is_admin_token
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BASE_DIR, "..", "..", "profiles"))
+# profiles kept on disk; the oldest go first
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# requests slower than this are kept automatically; 0 disables capture
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# samples held in memory, which bounds how much of a long request is kept
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SKIP_PATHS = ("/admin/", "/metrics", "/static/")
+
+PROFILE_HEADER = b"x-profile"
+
+PROFILES_CAPTURED = metrics.Counter(
+    "scalp_profiles_captured_total",
+    "Request profiles written to the profile ring, by what triggered them",
+    ("trigger",),
+)
+
+# stack leaves of a thread that is waiting rather than working
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("socketserver.py", "serve_forever"),
+}
+
+_PROFILE_ID = re.compile(r"^\d{13}-[0-9a-f]{8}$")
+
+# image details of the request being profiled, appended to by annotate_upload()
+_images = contextvars.ContextVar("profile_images", default=None)
+# id of the profiled request the current code runs for
+_request = contextvars.ContextVar("profile_request", default=None)
+# thread ident -> ids of the profiled requests it is working for, see working_for()
+_working = {}
+
+
+def current_request() -> str | None:
+    """Id of the profiled request the caller runs for, if any."""
+    return _request.get()
+
+
+@contextlib.contextmanager
+def working_for(request_ids):
+    """Attribute the calling thread's samples to the profiled ``request_ids`` within the block."""
+    request_ids = tuple(r for r in request_ids if r is not None)
+    if not request_ids:
+        yield
+        return
+    ident = threading.get_ident()
+    _working[ident] = request_ids
+    try:
+        yield
+    finally:
+        _working.pop(ident, None)
+
+
+def bind(fn):
+    """``fn`` wrapped for an executor, so its samples count for the caller's profiled request."""
+    request_id = _request.get()
+    if request_id is None:
+        return fn
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        with working_for((request_id,)):
+            return context.run(fn, *args, **kwargs)
+    return run
+
+
+def annotate_upload(upload):
+    """Record an upload's size, format and dimensions on the current profile, if any."""
+    images = _images.get()
+    if images is None:
+        return
+    info = {"size": upload.size, "format": upload.format, "width": None, "height": None}
+    try:
+        position = upload.file.tell()
+        try:
+            # only the header is read
+            info["width"], info["height"] = Image.open(upload.file).size
+        finally:
+            upload.file.seek(position)
+    except Exception:
+        pass
+    images.append(info)
+
+
+class StackSampler:
+    """Samples the threads working for open profiles while there are any.
+
+    A profile is opened with the event-loop frame of its request, and the
+    loop's samples belong to it while that frame is on the stack; other
+    threads are attributed through ``working_for()``. Frames are interned
+    at function granularity and whole stacks are interned too, so a sample
+    is a few small ints and the request ids per busy thread.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000,
+                 max_seconds: float = PROFILE_MAX_SECONDS):
+        self.interval = interval
+        self._samples = deque(maxlen=max(1, int(max_seconds / interval)))
+        self._frames = {}
+        self._stacks = {}
+        # event-loop frame of each open profile's request -> its id
+        self._markers = {}
+        # threads those frames run on, with how many open profiles each
+        self._marker_threads = Counter()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def begin(self, request_id: str, frame) -> float:
+        """Open a profile for the request whose coroutine ``frame`` runs on this thread."""
+        with self._cond:
+            self._markers[frame] = request_id
+            self._marker_threads[threading.get_ident()] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return time.perf_counter()
+
+    def end(self, frame, since: float, keep: bool = True) -> dict | None:
+        """Close the profile opened with ``frame`` at ``since``; returns its frames and stacks.
+
+        With ``keep`` false the samples are not looked at and None is returned.
+        """
+        with self._cond:
+            request_id = self._markers.pop(frame)
+            if keep:
+                counts = Counter(
+                    (thread, stack) for t, taken in self._samples if t >= since
+                    for thread, stack, request_ids in taken if request_id in request_ids
+                )
+                frames_by_id = {i: key for key, i in self._frames.items()}
+                stacks_by_id = {i: key for key, i in self._stacks.items()}
+            ident = threading.get_ident()
+            self._marker_threads[ident] -= 1
+            if not self._marker_threads[ident]:
+                del self._marker_threads[ident]
+            if not self._markers:
+                # nothing refers to the tables any more; keeps them from growing forever
+                self._samples.clear()
+                self._frames.clear()
+                self._stacks.clear()
+        if not keep:
+            return None
+
+        frames, local = [], {}
+        samples = []
+        for (thread, stack_id), count in counts.items():
+            stack = []
+            for frame_id in stacks_by_id[stack_id]:
+                if frame_id not in local:
+                    local[frame_id] = len(frames)
+                    frames.append(list(frames_by_id[frame_id]))
+                stack.append(local[frame_id])
+            samples.append([thread, stack, count])
+        return {"interval_ms": self.interval * 1000, "frames": frames, "samples": samples}
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._cond:
+                while not self._markers:
+                    self._cond.wait()
+                self._sample(me)
+            time.sleep(self.interval)
+
+    def _sample(self, me):
+        # caller holds the lock
+        names = None
+        taken = []
+        for ident, frame in sys._current_frames().items():
+            request_ids = _working.get(ident, ())
+            if ident == me or not (request_ids or ident in self._marker_threads):
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                stack.append(self._frames.setdefault(key, len(self._frames)))
+                marker = self._markers.get(frame)
+                if marker is not None:
+                    request_ids += (marker,)
+                frame = frame.f_back
+            if not request_ids:
+                continue  # the event loop, busy with an unprofiled request
+            if names is None:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            stack = self._stacks.setdefault(tuple(reversed(stack)), len(self._stacks))
+            taken.append((names.get(ident, str(ident)), stack, request_ids))
+        if taken:
+            self._samples.append((time.perf_counter(), tuple(taken)))
+
+
+class ProfileStore:
+    """Ring of profiles on disk, shared by every worker that points at the directory.
+
+    Each profile is a small ``<id>.meta.json`` for listing plus the samples
+    in ``<id>.profile.json.gz``. Ids sort by creation time.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP):
+        self.directory = directory
+        self.keep = max(1, keep)
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        if not _PROFILE_ID.match(profile_id):
+            raise KeyError(profile_id)
+        return os.path.join(self.directory, profile_id + suffix)
+
+    def save(self, meta: dict, profile: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        data_path = self._path(meta["id"], ".profile.json.gz")
+        meta_path = self._path(meta["id"], ".meta.json")
+        with gzip.open(data_path + ".tmp", "wt") as f:
+            json.dump(profile, f)
+        os.replace(data_path + ".tmp", data_path)
+        # the meta file goes last; a profile is listed only once it is complete
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        self._prune()
+
+    def _prune(self):
+        ids = self._ids()
+        for profile_id in ids[:-self.keep]:
+            for suffix in (".meta.json", ".profile.json.gz"):
+                try:
+                    os.unlink(self._path(profile_id, suffix))
+                except FileNotFoundError:
+                    pass  # another worker pruned it first
+
+    def _ids(self) -> list[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(n[:-len(".meta.json")] for n in names if n.endswith(".meta.json"))
+
+    def list(self) -> list[dict]:
+        """Metadata of the stored profiles, newest first."""
+        items = []
+        for profile_id in reversed(self._ids()):
+            try:
+                with open(self._path(profile_id, ".meta.json")) as f:
+                    items.append(json.load(f))
+            except FileNotFoundError:
+                continue
+        return items
+
+    def load(self, profile_id: str) -> tuple[dict, dict]:
+        """``(meta, profile)``; raises ``KeyError`` for an unknown id."""
+        try:
+            with open(self._path(profile_id, ".meta.json")) as f:
+                meta = json.load(f)
+            with gzip.open(self._path(profile_id, ".profile.json.gz"), "rt") as f:
+                return meta, json.load(f)
+        except FileNotFoundError:
+            raise KeyError(profile_id)
+
+
+profiles = ProfileStore()
+
+
+def to_speedscope(meta: dict, profile: dict) -> dict:
+    """The profile in speedscope's file format, one sampled profile per thread."""
+    interval = profile["interval_ms"]
+    by_thread = {}
+    for thread, stack, count in profile["samples"]:
+        samples, weights = by_thread.setdefault(thread, ([], []))
+        samples.append(stack)
+        weights.append(count * interval)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"{meta['method']} {meta['path']} {meta['duration_ms']:.0f}ms",
+        "exporter": "scalp-analysis",
+        "shared": {"frames": [{"name": name, "file": file, "line": line}
+                              for file, line, name in profile["frames"]]},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": thread,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+            for thread, (samples, weights) in sorted(by_thread.items())
+        ],
+    }
+
+
+def to_pstats(profile: dict) -> bytes:
+    """The profile as a marshalled ``pstats`` table, loadable with ``pstats.Stats(path)``.
+
+    Times are sample counts times the interval; call counts are sample
+    counts. Each thread is a root pseudo-function named after it.
+    """
+    interval = profile["interval_ms"] / 1000
+    frames = [tuple(frame) for frame in profile["frames"]]
+    stats = {}
+
+    def entry(key):
+        return stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+
+    for thread, stack, count in profile["samples"]:
+        seconds = count * interval
+        keys = [("~", 0, f"<thread {thread}>")] + [frames[i] for i in stack]
+        for key in set(keys):
+            e = entry(key)
+            e[0] += count
+            e[1] += count
+            e[3] += seconds
+        entry(keys[-1])[2] += seconds
+        for caller, callee in set(zip(keys, keys[1:])):
+            edge = entry(callee)[4].setdefault(caller, [0, 0, 0.0, 0.0])
+            edge[0] += count
+            edge[1] += count
+            edge[3] += seconds
+            if callee == keys[-1]:
+                edge[2] += seconds
+
+    return marshal.dumps({
+        key: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.items()})
+        for key, (cc, nc, tt, ct, callers) in stats.items()
+    })
+
+
+def _new_id() -> str:
+    return f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+
+
+class ProfilingMiddleware:
+    """Decides which requests to profile and stores the profiles worth keeping.
+
+    Explicitly requested and sampled profiles are always kept and their id
+    is returned in ``X-Profile-Id``; with ``PROFILE_SLOW_MS`` every other
+    request is sampled too and kept only when it was slow.
+    """
+
+    def __init__(self, app, sampler: StackSampler | None = None, store: ProfileStore | None = None,
+                 sample_rate: float = PROFILE_SAMPLE_RATE, slow_ms: float = PROFILE_SLOW_MS):
+        self.app = app
+        self.sampler = sampler or StackSampler()
+        self.store = store or profiles
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    def _trigger(self, scope) -> str | None:
+        header = dict(scope["headers"]).get(PROFILE_HEADER)
+        if header is not None and is_admin_token(header.decode("latin-1")):
+            return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        if self.slow_ms > 0:
+            return "slow"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(PROFILE_SKIP_PATHS):
+            await self.app(scope, receive, send)
+            return
+        trigger = self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = _new_id()
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trigger != "slow":
+                    message = {**message, "headers": [
+                        *message.get("headers", []), (b"x-profile-id", profile_id.encode())
+                    ]}
+            await send(message)
+
+        images = []
+        images_token = _images.set(images)
+        request_token = _request.set(profile_id)
+        created_at = datetime.utcnow()
+        # this coroutine's frame is on the loop's stack whenever the request runs
+        frame = sys._getframe()
+        started = self.sampler.begin(profile_id, frame)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            keep = trigger != "slow" or duration_ms >= self.slow_ms
+            profile = self.sampler.end(frame, started, keep)
+            _request.reset(request_token)
+            _images.reset(images_token)
+
+        if profile is None:
+            return
+        meta = {
+            "id": profile_id,
+            "created_at": created_at.isoformat(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": round(duration_ms, 2),
+            "trigger": trigger,
+            "samples": sum(count for _, _, count in profile["samples"]),
+            "images": images,
+        }
+        try:
+            # off the event loop; the response has already gone out
+            await asyncio.to_thread(self.store.save, meta, profile)
+        except OSError:
+            logger.exception("could not store profile %s", profile_id)
+            return
+        PROFILES_CAPTURED.inc(trigger=trigger)
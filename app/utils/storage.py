@@ -0,0 +1,159 @@
+import asyncio
+import io
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+from app.database import SessionLocal
+from app.ml.cache import image_digest
+from app.ml.instrumentation import STAGE_SECONDS
+from app.models import DiagnosisSummary, History
+from app.utils import profiling
+from app.utils.ingest import open_source
+
+UPLOAD_DIR = "static/uploads"
+UPLOAD_URL = "/static/uploads"
+THUMB_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+THUMB_SUFFIX = "_thumb.webp"
+
+_EXT_ALIASES = {"jpeg": "jpg", "heif": "heic"}
+
+# mkstemp creates files 0600; stored files get the mode open() would give them.
+# Reading the umask means setting it, so it is done once, at import.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+
+@dataclass
+class StoredImage:
+    digest: str
+    image_url: str
+    thumbnail_url: str
+
+
+def _relpath(digest: str, name: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+
+def thumbnail_url(image_url: str) -> str | None:
+    # thumbnails only exist for the content-addressed layout
+    prefix = UPLOAD_URL + "/"
+    if not image_url or not image_url.startswith(prefix):
+        return None
+    if image_url[len(prefix):].count("/") != 2:
+        return None
+    return os.path.splitext(image_url)[0] + THUMB_SUFFIX
+
+
+def local_path(image_url: str) -> str:
+    """Filesystem path of a stored upload, from its public URL."""
+    prefix = UPLOAD_URL + "/"
+    if not image_url.startswith(prefix):
+        raise ValueError(f"not an upload URL: {image_url}")
+    return os.path.join(UPLOAD_DIR, image_url[len(prefix):])
+
+
+def _write_atomic(path: str, source):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), FILE_MODE)
+            shutil.copyfileobj(open_source(source), f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def make_thumbnail(source) -> bytes:
+    img = Image.open(open_source(source))
+    img.draft("RGB", (THUMB_SIZE, THUMB_SIZE))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+    out = io.BytesIO()
+    img.save(out, "WEBP", quality=80, method=4)
+    return out.getvalue()
+
+
+def save_upload(source, ext: str, digest: str | None = None) -> StoredImage:
+    """Store an upload under its content hash; identical bytes are written once.
+
+    Files go to ``static/uploads/ab/cd/<sha256>.<ext>`` next to a small WebP
+    thumbnail. Writes go through a temp file and ``os.replace`` so readers
+    never see a partial file. ``source`` is bytes or a seekable file.
+    """
+    digest = digest or image_digest(source)
+    ext = _EXT_ALIASES.get(ext.lower(), ext.lower())
+    name = _relpath(digest, f"{digest}.{ext}")
+    thumb = _relpath(digest, digest + THUMB_SUFFIX)
+
+    path = os.path.join(UPLOAD_DIR, name)
+    if not os.path.exists(path):
+        _write_atomic(path, source)
+
+    thumb_path = os.path.join(UPLOAD_DIR, thumb)
+    if not os.path.exists(thumb_path):
+        _write_atomic(thumb_path, make_thumbnail(source))
+
+    return StoredImage(digest, f"{UPLOAD_URL}/{name}", f"{UPLOAD_URL}/{thumb}")
+
+
+def _timed_save(source, ext, digest):
+    with STAGE_SECONDS.time(stage="file_write"):
+        return save_upload(source, ext, digest)
+
+
+async def save_upload_async(source, ext: str, digest: str | None = None) -> StoredImage:
+    return await asyncio.to_thread(profiling.bind(_timed_save), source, ext, digest)
+
+
+def migrate_flat_uploads():
+    """Move files from the old flat ``static/uploads/<uuid>.<ext>`` layout.
+
+    Each file is re-stored by content hash, the ``History.image_path``
+    rows and summary latest images pointing at it are rewritten, and the
+    original is removed. Safe to run again; files already in the new
+    layout are left alone.
+    """
+    moved = 0
+    db = SessionLocal()
+    try:
+        for entry in sorted(os.scandir(UPLOAD_DIR), key=lambda e: e.name):
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            with open(entry.path, "rb") as f:
+                image_bytes = f.read()
+            ext = entry.name.rsplit(".", 1)[-1] if "." in entry.name else "bin"
+            try:
+                stored = save_upload(image_bytes, ext)
+            except OSError as e:
+                print(f"skip {entry.name}: {e}", file=sys.stderr)
+                continue
+
+            old_url = f"{UPLOAD_URL}/{entry.name}"
+            db.query(History).filter(History.image_path == old_url).update(
+                {History.image_path: stored.image_url}, synchronize_session=False
+            )
+            db.query(DiagnosisSummary).filter(DiagnosisSummary.last_image_path == old_url).update(
+                {DiagnosisSummary.last_image_path: stored.image_url}, synchronize_session=False
+            )
+            db.commit()
+            os.unlink(entry.path)
+            moved += 1
+            print(f"{old_url} -> {stored.image_url}")
+    finally:
+        db.close()
+    print(f"{moved} file(s) migrated")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        sys.exit("usage: python -m app.utils.storage migrate")
+    migrate_flat_uploads()
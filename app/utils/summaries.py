@@ -0,0 +1,209 @@
+"""Per-user diagnosis aggregates behind ``GET /history/summary``.
+
+Every writer of History rows calls ``apply_histories`` in the same
+transaction as its insert, so ``diagnosis_summaries`` always agrees with
+``histories`` and a dashboard read touches one row per disease instead of
+grouping the user's whole history.
+
+    python -m app.utils.summaries rebuild
+
+recomputes the table from ``histories``, a chunk of users per transaction.
+"""
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.database import SessionLocal
+from app.models import DiagnosisSummary, History
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# users recomputed per transaction by the rebuild
+REBUILD_USERS_PER_CHUNK = int(os.getenv("SUMMARY_REBUILD_USERS_PER_CHUNK", "500"))
+# History rows fetched per round trip while streaming a chunk
+REBUILD_FETCH_ROWS = int(os.getenv("SUMMARY_REBUILD_FETCH_ROWS", "5000"))
+SUMMARY_UPDATES = metrics.Counter(
+    "scalp_diagnosis_summary_updates_total",
+    "History rows folded into the diagnosis summaries",
+)
+
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def aggregate(rows) -> dict:
+    """Fold History row dicts into ``{(user_id, disease): summary values}``."""
+    totals = defaultdict(lambda: {"count": 0, "confidence_sum": 0.0, "last_at": None})
+    for row in rows:
+        if not row.get("user_id"):
+            continue
+        entry = totals[(row["user_id"], row["disease"])]
+        entry["count"] += 1
+        entry["confidence_sum"] += row["confidence"]
+        if entry["last_at"] is None or row["created_at"] >= entry["last_at"]:
+            entry["last_at"] = row["created_at"]
+            entry["last_confidence"] = row["confidence"]
+            entry["last_image_path"] = row["image_path"]
+    return totals
+
+
+def _values(totals):
+    return [{"user_id": user_id, "disease": disease, **entry}
+            for (user_id, disease), entry in totals.items()]
+
+
+def _merged(incoming):
+    # how an existing summary row absorbs new totals; ``incoming`` is the
+    # upsert's excluded row or a plain dict of values
+    newer = DiagnosisSummary.last_at <= incoming["last_at"]
+    latest = {
+        name: case((newer, incoming[name]), else_=getattr(DiagnosisSummary, name))
+        for name in ("last_confidence", "last_image_path", "last_at")
+    }
+    return {
+        "count": DiagnosisSummary.count + incoming["count"],
+        "confidence_sum": DiagnosisSummary.confidence_sum + incoming["confidence_sum"],
+        **latest,
+    }
+
+
+def apply_histories(db, rows):
+    """Add freshly inserted History rows to their users' summaries.
+
+    Runs in the caller's transaction and does not commit. Each row needs
+    ``user_id``, ``disease``, ``confidence``, ``image_path`` and
+    ``created_at``; rows without a user are skipped.
+    """
+    values = _values(aggregate(rows))
+    if not values:
+        return
+    upsert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert is not None:
+        # parameters passed as a list, so the statement compiles once and is cached
+        stmt = upsert(DiagnosisSummary)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[DiagnosisSummary.user_id, DiagnosisSummary.disease],
+            set_=_merged(stmt.excluded),
+        ), values)
+    else:
+        # no ON CONFLICT: update the existing row, insert when there is none
+        for value in values:
+            result = db.execute(
+                update(DiagnosisSummary)
+                .where(DiagnosisSummary.user_id == value["user_id"],
+                       DiagnosisSummary.disease == value["disease"])
+                .values(_merged(value))
+            )
+            if result.rowcount == 0:
+                db.execute(insert(DiagnosisSummary).values(value))
+    SUMMARY_UPDATES.inc(sum(v["count"] for v in values))
+
+
+def user_summary(db, user_id: int) -> list[DiagnosisSummary]:
+    return (
+        db.query(DiagnosisSummary)
+        .filter(DiagnosisSummary.user_id == user_id)
+        .order_by(DiagnosisSummary.count.desc(), DiagnosisSummary.disease)
+        .all()
+    )
+
+
+def _recompute(db, condition, fetch_rows: int) -> int:
+    # insert fresh summaries for the History rows matching ``condition``; returns rows read
+    totals = {}
+    read = 0
+    rows = db.execute(
+        select(History.user_id, History.disease, History.confidence,
+               History.image_path, History.created_at)
+        .where(condition)
+        .execution_options(yield_per=fetch_rows)
+    ).mappings()
+    for part in rows.partitions():
+        read += len(part)
+        for key, entry in aggregate(part).items():
+            _fold(totals, key, entry)
+    if totals:
+        db.execute(insert(DiagnosisSummary), _values(totals))
+    return read
+
+
+def _fold(totals, key, entry):
+    current = totals.get(key)
+    if current is None:
+        totals[key] = entry
+        return
+    current["count"] += entry["count"]
+    current["confidence_sum"] += entry["confidence_sum"]
+    if entry["last_at"] >= current["last_at"]:
+        for name in ("last_at", "last_confidence", "last_image_path"):
+            current[name] = entry[name]
+
+
+def refresh_users(db, user_ids, fetch_rows: int = REBUILD_FETCH_ROWS) -> int:
+    """Recompute the summaries of ``user_ids`` after their History rows were changed in place.
+
+    Runs in the caller's transaction and does not commit.
+    """
+    user_ids = sorted({u for u in user_ids if u})
+    if not user_ids:
+        return 0
+    db.execute(delete(DiagnosisSummary).where(DiagnosisSummary.user_id.in_(user_ids)))
+    return _recompute(db, History.user_id.in_(user_ids), fetch_rows)
+
+
+def rebuild(session_factory=SessionLocal, users_per_chunk: int = REBUILD_USERS_PER_CHUNK,
+            fetch_rows: int = REBUILD_FETCH_ROWS) -> int:
+    """Recompute every summary from ``histories``; returns the History rows read.
+
+    Users are taken in ascending id order, ``users_per_chunk`` at a time.
+    Each chunk's summaries are deleted and rewritten in one transaction
+    while its History rows stream in ``fetch_rows`` at a time, so memory
+    stays bounded by the chunk and inserts for other users are never held
+    up for long. Summaries of users who no longer have any history go too.
+    """
+    db = session_factory()
+    read = 0
+    last_user = 0
+    try:
+        while True:
+            user_ids = db.scalars(
+                select(History.user_id).distinct()
+                .where(History.user_id > last_user)
+                .order_by(History.user_id)
+                .limit(users_per_chunk)
+            ).all()
+            if not user_ids:
+                break
+
+            # deleting first takes SQLite's write lock, so no insert can land
+            # between reading the chunk and replacing its summaries; the
+            # range, not the list, also clears users who lost their history
+            db.execute(delete(DiagnosisSummary).where(
+                DiagnosisSummary.user_id > last_user,
+                DiagnosisSummary.user_id <= user_ids[-1],
+            ))
+            read += _recompute(db, History.user_id.between(user_ids[0], user_ids[-1]), fetch_rows)
+            db.commit()
+            last_user = user_ids[-1]
+            logger.info("rebuilt summaries up to user %d (%d history rows)", last_user, read)
+
+        db.execute(delete(DiagnosisSummary).where(DiagnosisSummary.user_id > last_user))
+        db.commit()
+    finally:
+        db.close()
+    return read
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m app.utils.summaries rebuild")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    started = time.perf_counter()
+    count = rebuild()
+    print(f"rebuilt diagnosis summaries from {count} history row(s) "
+          f"in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,138 @@
+"""Prediction job worker.
+
+    python -m app.worker
+
+Claims jobs queued by ``POST /predict/jobs`` and runs them through the same
+pipeline as ``predict()`` on a pool of processes, each with its own model.
+Results and History rows are written by this parent process, one
+transaction per job. SIGINT/SIGTERM stop claiming and let running jobs
+finish; jobs left behind by a crash are picked up again once their lease
+expires.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from app.database import SessionLocal
+from app.migrations import run_migrations
+from app.utils import job_queue
+from app.utils.storage import StoredImage, local_path, thumbnail_url
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("PREDICTION_JOB_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+POLL_INTERVAL = float(os.getenv("PREDICTION_JOB_POLL_INTERVAL", "0.5"))
+
+
+def _init_process(threads: int):
+    # shutdown is driven by the parent, which lets running jobs finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # split the cores between the pool processes instead of oversubscribing
+    os.environ.setdefault("INTERPRETER_THREADS", str(threads))
+    os.environ.setdefault("INFERENCE_WORKERS", "1")
+    os.environ.setdefault("PREPROCESS_WORKERS", "1")
+    from app.ml import hair_classification
+    hair_classification.load_model()
+
+
+def _run_prediction(path: str, digest: str):
+    from app.ml import hair_classification
+
+    with open(path, "rb") as f:
+        try:
+            return "ok", (*hair_classification.predict(f, digest), hair_classification.MODEL_VERSION)
+        except ValueError as e:
+            return "rejected", str(e)
+
+
+def _finish(db, job, worker_id, outcome, value):
+    from app.routes.predict_routes import prediction_result, rejection_result
+
+    if outcome == "rejected":
+        return job_queue.complete(db, job, worker_id, rejection_result(value))
+
+    label, confidence, status, model_version = value
+    stored = StoredImage(job.digest, job.image_path, thumbnail_url(job.image_path))
+    history = None
+    if job.user_id:
+        history = {
+            "user_id": job.user_id,
+            "disease": label,
+            "confidence": confidence,
+            "image_path": job.image_path,
+            "model_version": model_version,
+        }
+    result = prediction_result(label, confidence, status, stored, job.gender)
+    return job_queue.complete(db, job, worker_id, result, history)
+
+
+def _make_pool(workers: int):
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn, not fork: the children load their own runtime and model
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_process,
+        initargs=(threads,),
+    )
+
+
+def run(workers: int = JOB_WORKERS, stop: threading.Event | None = None):
+    stop = stop or threading.Event()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    pool = _make_pool(workers)
+    running = {}
+    db = SessionLocal()
+    logger.info("worker %s started with %d process(es)", worker_id, workers)
+    try:
+        while not stop.is_set() or running:
+            capacity = workers * 2 - len(running)
+            if capacity > 0 and not stop.is_set():
+                for job in job_queue.claim(db, worker_id, capacity):
+                    fut = pool.submit(_run_prediction, local_path(job.image_path), job.digest)
+                    running[fut] = job
+
+            if not running:
+                stop.wait(POLL_INTERVAL)
+                continue
+
+            done, _ = wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            broken = False
+            for fut in done:
+                job = running.pop(fut)
+                try:
+                    outcome, value = fut.result()
+                    settled = _finish(db, job, worker_id, outcome, value)
+                except BrokenProcessPool as e:
+                    # a pool process died (OOM, segfault); every job on the pool fails with it
+                    broken = True
+                    settled = job_queue.retry_or_fail(db, job, worker_id, f"worker process died: {e}")
+                except Exception as e:
+                    logger.exception("job %s failed", job.id)
+                    db.rollback()
+                    settled = job_queue.retry_or_fail(db, job, worker_id, f"{type(e).__name__}: {e}")
+                if not settled:
+                    logger.warning("job %s was re-claimed elsewhere; result dropped", job.id)
+            if broken:
+                logger.error("process pool broke, starting a new one")
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = _make_pool(workers)
+    finally:
+        db.close()
+        pool.shutdown(wait=True, cancel_futures=True)
+        logger.info("worker %s stopped", worker_id)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    run_migrations()
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+    run(stop=stop_event)
@@ -0,0 +1,77 @@
+"""Per-request cost of bearer-token authentication.
+
+    python -m benchmarks.auth_overhead [requests]
+
+Runs in-process against the ASGI app with a throwaway SQLite database and
+compares an unauthenticated endpoint, GET /auth/me with warm caches, and
+GET /auth/me with the claims and user caches cleared before every request
+(JWT verification plus a user query each time).
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+async def _timed(client, n, path, headers=None, before=None):
+    samples = []
+    for _ in range(n):
+        if before:
+            before()
+        started = time.perf_counter()
+        response = await client.get(path, headers=headers)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.text
+    samples.sort()
+    return samples
+
+
+def _report(name, samples):
+    p50 = samples[len(samples) // 2]
+    p95 = samples[int(len(samples) * 0.95)]
+    print(f"{name:28} {statistics.mean(samples):8.3f} {p50:8.3f} {p95:8.3f}")
+
+
+async def run(n):
+    import httpx
+
+    from app import auth
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/auth/register", json={
+            "username": "bench", "email": "bench@example.com", "password": "Bench.passw0rd",
+            "full_name": "Bench", "gender": "male",
+        })
+        response = await client.post("/auth/login", json={
+            "username": "bench", "password": "Bench.passw0rd",
+        })
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        def clear():
+            auth._claims_cache.clear()
+            auth._user_cache.clear()
+
+        for path, h in (("/", None), ("/auth/me", headers)):
+            await _timed(client, 50, path, h)
+
+        print(f"{'case':28} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        _report("unauthenticated GET /", await _timed(client, n, "/"))
+        _report("GET /auth/me, cached", await _timed(client, n, "/auth/me", headers))
+        _report("GET /auth/me, uncached", await _timed(client, n, "/auth/me", headers, clear))
+
+
+def main(n="2000"):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ.setdefault("BCRYPT_ROUNDS", "10")
+        from app.migrations import run_migrations
+        run_migrations()
+        asyncio.run(run(int(n)))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,185 @@
+"""Concurrent read/write throughput of the database, before and after tuning.
+
+    python -m benchmarks.db_bench [--seconds 10] [--readers 8] [--writers 2]
+                                  [--users 20000] [--histories 100000]
+
+Seeds two identical throwaway SQLite databases and runs the same mixed
+workload against each: readers page through a user's history and look up
+a reset code, writers insert History rows one commit at a time as
+/predict/ does. "before" uses SQLite's default journal and sync settings
+and only the original indexes; "after" uses the pragmas from
+``app.database``, the password_resets indexes and one purge pass.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NEW_INDEXES = ("ix_password_resets_user_code_expires", "ix_password_resets_expired_at")
+
+
+def seed(engine, users, histories, seed_value=0):
+    from app.models import History, PasswordReset, User
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"id": i, "email": f"u{i}@example.com", "username": f"u{i}", "full_name": "U",
+             "gender": "male", "hashed_password": "x"}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(History), [
+            {"user_id": rng.randint(1, users), "disease": "normal", "confidence": 0.9,
+             "image_path": "/static/uploads/x.jpg",
+             "created_at": now - timedelta(minutes=rng.randint(0, 500_000))}
+            for _ in range(histories)
+        ])
+        # every user who ever asked keeps a code; only a few are still live
+        conn.execute(insert(PasswordReset), [
+            {"user_id": i, "code": f"{rng.randint(0, 999_999):06d}",
+             "expired_at": now + timedelta(minutes=10) if rng.random() < 0.05
+             else now - timedelta(days=rng.randint(1, 365))}
+            for i in range(1, users + 1)
+        ])
+
+
+def workload(session_factory, users, seconds, readers, writers):
+    from app.models import History, PasswordReset
+    from app.utils.history_recorder import save_histories
+
+    stop = time.perf_counter() + seconds
+    results = {"read": [], "write": [], "errors": 0}
+    lock = threading.Lock()
+
+    def reader(n):
+        rng = random.Random(n)
+        samples, errors = [], 0
+        db = session_factory()
+        while time.perf_counter() < stop:
+            user_id = rng.randint(1, users)
+            started = time.perf_counter()
+            try:
+                db.query(History).filter(History.user_id == user_id).order_by(
+                    History.created_at.desc(), History.id.desc()
+                ).limit(21).all()
+                db.query(PasswordReset).filter(
+                    PasswordReset.user_id == user_id,
+                    PasswordReset.code == f"{rng.randint(0, 999_999):06d}",
+                    PasswordReset.expired_at > datetime.utcnow(),
+                ).first()
+                db.rollback()
+            except OperationalError:
+                db.rollback()
+                errors += 1
+                continue
+            samples.append((time.perf_counter() - started) * 1000)
+        db.close()
+        with lock:
+            results["read"] += samples
+            results["errors"] += errors
+
+    def writer(n):
+        rng = random.Random(1000 + n)
+        samples, errors = [], 0
+        db = session_factory()
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            try:
+                save_histories(db, [{
+                    "user_id": rng.randint(1, users), "disease": "normal",
+                    "confidence": 0.9, "image_path": "/static/uploads/bench.jpg",
+                }])
+            except OperationalError:
+                db.rollback()
+                errors += 1
+                continue
+            samples.append((time.perf_counter() - started) * 1000)
+        db.close()
+        with lock:
+            results["write"] += samples
+            results["errors"] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    def stats(samples):
+        s = np.asarray(samples) if samples else np.zeros(1)
+        return len(samples) / seconds, float(np.percentile(s, 50)), float(np.percentile(s, 95))
+
+    return {"read": stats(results["read"]), "write": stats(results["write"]),
+            "errors": results["errors"]}
+
+
+def run_config(name, path, args, tuned):
+    from app.database import make_engine
+    from app.migrations import run_migrations
+    from app.utils.maintenance import purge_expired_resets
+
+    engine = make_engine(f"sqlite:///{path}", None if tuned else {})
+    run_migrations(engine)
+    seed(engine, args.users, args.histories)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    purged = 0
+    if tuned:
+        db = session_factory()
+        purged = purge_expired_resets(db)
+        db.close()
+    with engine.begin() as conn:
+        if not tuned:
+            for index in NEW_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+        conn.execute(text("ANALYZE"))
+        mode = conn.execute(text("PRAGMA journal_mode")).scalar()
+
+    result = workload(session_factory, args.users, args.seconds, args.readers, args.writers)
+    engine.dispose()
+    print(f"{name:7} journal={mode:7} purged={purged:6}  "
+          f"reads/s {result['read'][0]:8.0f} (p50 {result['read'][1]:6.2f} p95 {result['read'][2]:7.2f} ms)  "
+          f"writes/s {result['write'][0]:7.0f} (p50 {result['write'][1]:6.2f} p95 {result['write'][2]:7.2f} ms)  "
+          f"locked {result['errors']}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--histories", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'unused.db')}",
+            "HISTORY_WRITE_BEHIND": "0",
+            "EMAIL_OUTBOX_SENDER": "0",
+        })
+        print(f"{args.readers} readers, {args.writers} writers, {args.seconds:g}s each")
+        before = run_config("before", os.path.join(tmp, "before.db"), args, tuned=False)
+        after = run_config("after", os.path.join(tmp, "after.db"), args, tuned=True)
+
+    for kind in ("read", "write"):
+        if before[kind][0]:
+            print(f"{kind} throughput x{after[kind][0] / before[kind][0]:.2f}")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+    main()
@@ -0,0 +1,71 @@
+"""Decode time and peak RSS per image: full-resolution decode vs decode_image().
+
+    python -m benchmarks.decode_bench [image_dir]
+
+Each measurement runs in a fresh process so ru_maxrss reflects one decode.
+A synthetic 12 MP JPEG is always included to represent a phone photo.
+"""
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.fixtures import stored_uploads
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(path, mode):
+    from app.ml.decode import decode_image
+
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    before = _rss_mb()
+    started = time.perf_counter()
+    if mode == "legacy":
+        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        np.array(img).mean()
+    else:
+        img, _ = decode_image(image_bytes)
+        np.asarray(img).mean()
+    elapsed = time.perf_counter() - started
+    return elapsed * 1000, _rss_mb() - before, img.size
+
+
+def synthetic_phone_jpeg(directory):
+    rng = np.random.default_rng(0)
+    base = rng.integers(90, 200, size=(378, 504, 3), dtype=np.uint8)
+    img = Image.fromarray(base).resize((4032, 3024), Image.BICUBIC)
+    path = os.path.join(directory, "synthetic_4032x3024.jpg")
+    img.save(path, quality=90)
+    return path
+
+
+def main(image_dir="static/uploads"):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = stored_uploads(image_dir)
+        paths.append(synthetic_phone_jpeg(tmp))
+
+        print(f"{'image':44} {'source':>11} {'decoded':>11} "
+              f"{'legacy ms':>10} {'new ms':>8} {'legacy MB':>10} {'new MB':>8}")
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+            for path in paths:
+                with Image.open(path) as im:
+                    source = "x".join(map(str, im.size))
+                old_ms, old_mb, _ = pool.submit(_measure, path, "legacy").result()
+                new_ms, new_mb, size = pool.submit(_measure, path, "new").result()
+                print(f"{os.path.basename(path)[:44]:44} {source:>11} "
+                      f"{'x'.join(map(str, size)):>11} {old_ms:10.1f} {new_ms:8.1f} "
+                      f"{old_mb:10.1f} {new_mb:8.1f}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
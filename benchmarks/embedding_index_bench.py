@@ -0,0 +1,83 @@
+"""Lookup and search latency of the embedding index as it grows.
+
+    python -m benchmarks.embedding_index_bench [--rows 1000000] [--dim 256]
+                                               [--users 5000] [--repeat 20]
+
+Builds a synthetic index in a temporary directory, then times, at each
+size: finding a row by History id and by image digest (the first of these
+includes sorting the lookup column), one user's similar-case search, a
+search over the whole index and a near-duplicate scan. The last two are
+linear in the index size by design; the lookups should not be.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from app.ml.embeddings import EmbeddingIndex
+
+APPEND_ROWS = 50_000
+
+
+def _digest(n: int) -> str:
+    # the index keys images by the first 16 hex digits of the sha256
+    return f"{n:016x}" + "0" * 48
+
+
+def _ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def _grow(index, start, stop, dim, users, rng):
+    sig = np.zeros(32, np.uint8)
+    for s in range(start, stop, APPEND_ROWS):
+        n = min(APPEND_ROWS, stop - s)
+        vectors = rng.standard_normal((n, dim), dtype=np.float32)
+        index.append([
+            (s + i + 1, (s + i) % users + 1, _digest(s + i), "a", 0.9, sig, vectors[i])
+            for i in range(n)
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    sizes = [n for n in (10_000, 100_000, 1_000_000, 10_000_000) if n < args.rows] + [args.rows]
+    print(f"{'rows':>10} {'first id':>9} {'by id':>8} {'by digest':>9} "
+          f"{'user k=5':>9} {'full k=5':>9} {'near dup':>9}   (ms)")
+    with tempfile.TemporaryDirectory() as tmp:
+        index = EmbeddingIndex(tmp, args.dim, ["a", "b"])
+        built = 0
+        for size in sizes:
+            _grow(index, built, size, args.dim, args.users, rng)
+            built = size
+            ids = rng.integers(1, size + 1, size=args.repeat)
+            started = time.perf_counter()
+            query = index.vector(int(ids[0]))
+            first = (time.perf_counter() - started) * 1000
+            it = iter(np.resize(ids, args.repeat * 2))
+            by_id = _ms(lambda: index.vector(int(next(it))), args.repeat)
+            by_digest = _ms(lambda: index.by_digest(_digest(int(next(it)) - 1)), args.repeat)
+            user = _ms(lambda: index.search(query, 5, user_id=int(ids[0]) % args.users), args.repeat)
+            full = _ms(lambda: index.search(query, 5), max(1, args.repeat // 10))
+            near = _ms(lambda: index.near_duplicate(np.ones(32, np.uint8), 4),
+                       max(1, args.repeat // 10))
+            print(f"{size:>10} {first:>9.2f} {by_id:>8.3f} {by_digest:>9.3f} "
+                  f"{user:>9.2f} {full:>9.1f} {near:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Synthetic inputs for the benchmarks: scalp-like photos and a stand-in model.
+
+Nothing here needs real user photos or the production weights.
+"""
+import glob
+import io
+import os
+import shutil
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.ml.quality import WORKING_MAX_SIDE
+
+# app.utils.storage.THUMB_SUFFIX; importing storage would open the database
+# before a benchmark points DATABASE_URL at its throwaway copy
+THUMB_SUFFIX = "_thumb.webp"
+
+# (width, height) of common phone camera outputs, plus a downscaled share
+PHONE_RESOLUTIONS = [
+    (4032, 3024),
+    (3024, 4032),
+    (4000, 3000),
+    (1920, 1080),
+    (1600, 1200),
+]
+
+
+def stored_uploads(image_dir: str) -> list[str]:
+    """Paths of the uploaded images under ``image_dir``, flat or content-addressed.
+
+    Generated thumbnails and in-progress temporary files are left out.
+    """
+    return sorted(
+        path for path in glob.glob(os.path.join(image_dir, "**", "*"), recursive=True)
+        if os.path.isfile(path)
+        and not path.endswith(THUMB_SUFFIX)
+        and not os.path.basename(path).startswith(".")
+    )
+
+
+def synthetic_scalp(width: int, height: int, seed: int = 0, quality: int = 90,
+                    native: bool = False) -> bytes:
+    """A skin-toned JPEG crossed by dark hair strands that passes the quality gate.
+
+    The texture is drawn at the quality gate's working resolution and then
+    upscaled, so the gate sees the same statistics at every output size.
+    With ``native`` it is drawn at full size instead, with pixel-level
+    detail like a real camera's, for checks that look at every pixel.
+    """
+    rng = np.random.default_rng(seed)
+    canvas_scale = 1.0 if native else min(1.0, WORKING_MAX_SIDE / max(width, height))
+    cw, ch = round(width * canvas_scale), round(height * canvas_scale)
+
+    # low-frequency skin tone variation plus fine sensor noise
+    coarse = rng.normal(0, 12, size=(ch // 64 + 2, cw // 64 + 2, 1))
+    tone = np.array([205, 150, 120]) + rng.integers(-15, 15, size=3)
+    base = Image.fromarray(np.clip(tone + coarse, 0, 255).astype(np.uint8))
+    base = base.resize((cw, ch), Image.BILINEAR)
+    arr = np.asarray(base, dtype=np.int16) + rng.integers(-10, 11, size=(ch, cw, 1))
+    img = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+    draw = ImageDraw.Draw(img)
+    unit = max(cw, ch) / 1000
+    for _ in range(int(600 * unit)):
+        x, y = rng.uniform(0, cw), rng.uniform(0, ch)
+        angle = rng.uniform(0, np.pi)
+        length = rng.uniform(60, 260) * unit
+        shade = int(rng.integers(20, 70))
+        draw.line(
+            [(x, y), (x + np.cos(angle) * length, y + np.sin(angle) * length)],
+            fill=(shade, max(0, shade - 5), shade // 2),
+            width=int(rng.integers(1, 4)),
+        )
+    img = img.filter(ImageFilter.GaussianBlur(radius=0.6))
+    if (cw, ch) != (width, height):
+        img = img.resize((width, height), Image.BICUBIC)
+
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+def standin_model(model_dir: str, labels_path: str, confident_label: int = 0,
+                  embeddings: bool = False) -> str:
+    """Write a tiny TFLite classifier with the production input/output shapes.
+
+    The output is biased towards one label so predictions pass the
+    confidence threshold and exercise the full success path. With
+    ``embeddings`` the pooled features are a second output, as in models
+    converted with ``--embeddings``. Needs TensorFlow, only to build the file.
+    """
+    import tensorflow as tf
+
+    with open(labels_path) as f:
+        n = len([l for l in f if l.strip()])
+    bias = np.zeros(n, dtype=np.float32)
+    bias[confident_label] = 6.0
+
+    model = tf.keras.Sequential([
+        tf.keras.Input((224, 224, 3)),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(n, activation="softmax",
+                              bias_initializer=tf.keras.initializers.Constant(bias)),
+    ])
+    model.build()
+    if embeddings:
+        model = tf.keras.Model(model.inputs, [model.outputs[0], model.layers[-1].input])
+    os.makedirs(model_dir, exist_ok=True)
+    path = os.path.join(model_dir, "vgg16_final.tflite")
+    with open(path, "wb") as f:
+        f.write(tf.lite.TFLiteConverter.from_keras_model(model).convert())
+    shutil.copy(labels_path, os.path.join(model_dir, "labels.txt"))
+    return path
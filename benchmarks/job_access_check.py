@@ -0,0 +1,80 @@
+"""Check who may read a queued prediction job.
+
+    python -m benchmarks.job_access_check
+
+Runs in-process against the ASGI app with a throwaway SQLite database.
+A job submitted with a token belongs to that user and must be a 404 for
+everyone else, callers without a token included; a job submitted
+anonymously is readable by anyone holding its id.
+
+Exits non-zero if any check fails.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+
+async def _login(client, name):
+    await client.post("/auth/register", json={
+        "username": name, "email": f"{name}@example.com", "password": "Check.passw0rd",
+        "full_name": name.title(), "gender": "female",
+    })
+    response = await client.post("/auth/login", json={
+        "username": name, "password": "Check.passw0rd",
+    })
+    token = response.json()["access_token"]
+    me = await client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+    return me.json()["id"], {"Authorization": f"Bearer {token}"}
+
+
+async def run() -> int:
+    import httpx
+
+    from app.database import SessionLocal
+    from app.main import app
+    from app.utils.job_queue import enqueue
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+        owner_id, owner = await _login(client, "owner")
+        _, other = await _login(client, "other")
+
+        db = SessionLocal()
+        try:
+            owned = enqueue(db, "/static/uploads/owned.jpg", "0" * 64, "female", owner_id).id
+            anonymous = enqueue(db, "/static/uploads/anon.jpg", "1" * 64, "male", None).id
+        finally:
+            db.close()
+
+        async def status(job_id, headers=None):
+            return (await client.get(f"/predict/jobs/{job_id}", headers=headers)).status_code
+
+        checks = [
+            ("owner reads their job", await status(owned, owner) == 200),
+            ("another user gets 404", await status(owned, other) == 404),
+            ("no token gets 404 for a user's job", await status(owned) == 404),
+            ("anonymous job readable without a token", await status(anonymous) == 200),
+            ("anonymous job readable with a token", await status(anonymous, other) == 200),
+            ("unknown job is 404", await status("0" * 32) == 404),
+        ]
+
+    failures = 0
+    for name, ok in checks:
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':5} {name}")
+    return 1 if failures else 0
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'jobs.db')}"
+        os.environ["EMAIL_OUTBOX_SENDER"] = "0"
+        os.environ.setdefault("BCRYPT_ROUNDS", "10")
+        from app.migrations import run_migrations
+        run_migrations()
+        return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
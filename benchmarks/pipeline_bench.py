@@ -0,0 +1,237 @@
+"""Where /predict/ spends its time: per-stage microbenchmarks and a load test.
+
+    python -m benchmarks.pipeline_bench [--concurrency 1,4,16] [--requests 200]
+                                        [--images 8] [--iterations 20]
+                                        [--real-model] [--output FILE]
+
+Runs entirely in a temporary directory with synthetic phone-resolution
+scalp photos, a throwaway SQLite database and (unless --real-model) a small
+stand-in TFLite model. Stages: decode, quality gate, resize/normalize,
+invoke and History write; then the full app is driven in-process through
+ASGI at each concurrency level. Results are printed and written as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.fixtures import PHONE_RESOLUTIONS, standin_model, synthetic_scalp
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(samples_ms):
+    s = np.sort(np.asarray(samples_ms))
+    return {
+        "n": int(s.size),
+        "mean_ms": float(s.mean()),
+        "p50_ms": float(np.percentile(s, 50)),
+        "p95_ms": float(np.percentile(s, 95)),
+        "p99_ms": float(np.percentile(s, 99)),
+    }
+
+
+def _time(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+def micro(images, iterations):
+    from app.database import SessionLocal
+    from app.ml import hair_classification as hc
+    from app.ml.decode import decode_image
+    from app.ml.quality import check_quality
+    from app.utils.history_recorder import save_histories
+
+    results = {}
+    for (width, height), data in images.items():
+        img, _ = decode_image(data)
+        x = hc.normalize(img)
+        results[f"{width}x{height}"] = {
+            "bytes": len(data),
+            "decode": _time(lambda: decode_image(data), iterations),
+            "quality_gate": _time(lambda: check_quality(img), iterations),
+            "resize_normalize": _time(lambda: hc.variant.quantize(hc.normalize(img)), iterations),
+        }
+
+    interp = hc.load_interpreter(hc.variant.path)
+    hc.warm_up(interp)
+    detail = interp.get_input_details()[0]
+    x = hc.variant.quantize(x)
+
+    def invoke():
+        interp.set_tensor(detail["index"], x)
+        interp.invoke()
+
+    def db_write():
+        db = SessionLocal()
+        try:
+            save_histories(db, [{
+                "user_id": 1, "disease": "normal", "confidence": 0.9,
+                "image_path": "/static/uploads/bench.jpg",
+            }])
+        finally:
+            db.close()
+
+    results["invoke"] = _time(invoke, iterations * 5)
+    results["db_write"] = _time(db_write, iterations * 5)
+    return results
+
+
+async def load_test(app, bodies, concurrency, total, headers):
+    import httpx
+
+    latencies, statuses = [], {}
+    counter = iter(range(total))
+
+    async def client_loop(client):
+        for i in counter:
+            files = {"file": ("scalp.jpg", bodies[i % len(bodies)], "image/jpeg")}
+            started = time.perf_counter()
+            response = await client.post("/predict/", files=files, headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            body = response.json()
+            if response.status_code != 200:
+                key = str(response.status_code)
+            else:
+                key = "predicted" if "disease" in body else body.get("message", "rejected")
+            statuses[key] = statuses.get(key, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": total / elapsed,
+        "latency": summarize(latencies),
+        "outcomes": statuses,
+        "peak_rss_mb": _rss_mb(),
+    }
+
+
+async def run_load(levels, total, bodies):
+    import httpx
+
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            while (await client.get("/ready")).status_code != 200:
+                await asyncio.sleep(0.05)
+            user = {"username": "bench", "password": "Bench.passw0rd"}
+            await client.post("/auth/register", json={
+                **user, "email": "bench@example.com", "full_name": "Bench", "gender": "male",
+            })
+            token = (await client.post("/auth/login", json=user)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        await load_test(app, bodies, 1, min(len(bodies), 4), headers)
+        return [await load_test(app, bodies, c, total, headers) for c in levels]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--images", type=int, default=8,
+                        help="distinct load-test images; each request misses the cache")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--real-model", action="store_true")
+    parser.add_argument("--output", default=f"pipeline_bench_{int(time.time())}.json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.real_model:
+            model_dir = os.path.join(tmp, "model")
+            standin_model(model_dir, os.path.join(REPO_DIR, "app", "ml", "model", "labels.txt"))
+            os.environ["MODEL_DIR"] = model_dir
+        os.environ.update({
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "PREDICTION_CACHE_PATH": "",
+            "PREDICTION_CACHE_SIZE": "0",
+            "EMAIL_OUTBOX_SENDER": "0",
+            "BCRYPT_ROUNDS": "10",
+        })
+        # uploads, thumbnails and the static mount all live under the cwd
+        os.chdir(tmp)
+
+        micro_images = {
+            size: synthetic_scalp(*size, seed=i) for i, size in enumerate(PHONE_RESOLUTIONS)
+        }
+        sizes = PHONE_RESOLUTIONS[:3]
+        bodies = [synthetic_scalp(*sizes[i % len(sizes)], seed=100 + i) for i in range(args.images)]
+
+        from app.migrations import run_migrations
+        from app.ml import hair_classification
+
+        run_migrations()
+        hair_classification.load_model()
+
+        results = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "model": "real" if args.real_model else "stand-in",
+            "variant": hair_classification.variant.metadata(),
+            "runtime": hair_classification.runtime,
+            "micro": micro(micro_images, args.iterations),
+            "load": asyncio.run(run_load(levels, args.requests, bodies)),
+        }
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name, stages in results["micro"].items():
+        if "p50_ms" in stages:
+            print(f"{name:18} p50 {stages['p50_ms']:8.2f} ms  p95 {stages['p95_ms']:8.2f} ms")
+            continue
+        print(name, f"({stages['bytes'] // 1024} KB)")
+        for stage in ("decode", "quality_gate", "resize_normalize"):
+            s = stages[stage]
+            print(f"  {stage:16} p50 {s['p50_ms']:8.2f} ms  p95 {s['p95_ms']:8.2f} ms")
+    print(f"{'concurrency':>11} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>7}  outcomes")
+    for r in results["load"]:
+        lat = r["latency"]
+        print(f"{r['concurrency']:11} {r['throughput_rps']:8.1f} {lat['p50_ms']:8.1f} "
+              f"{lat['p95_ms']:8.1f} {lat['p99_ms']:8.1f} {r['peak_rss_mb']:7.0f}  {r['outcomes']}")
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+    main()
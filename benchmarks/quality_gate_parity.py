@@ -0,0 +1,107 @@
+"""Compare decode + quality gate against the original full-resolution checks.
+
+    python -m benchmarks.quality_gate_parity [image_dir]
+
+Besides the images in ``image_dir``, synthetic scalp photos at the
+``PHONE_RESOLUTIONS`` sizes, drawn at full resolution, are compared so
+the bounded working copy taken above ``QUALITY_MAX_SIDE`` is covered as
+well. Exits non-zero if
+any image gets a different accept/reject decision.
+"""
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.ml.decode import decode_image
+from app.ml.quality import check_quality
+from benchmarks.fixtures import PHONE_RESOLUTIONS, stored_uploads, synthetic_scalp
+
+
+def legacy_gate(img):
+    img_np = np.array(img)
+    gray = np.mean(img_np, axis=2)
+
+    brightness = np.mean(gray)
+    contrast = np.std(gray)
+    mean_color_std = np.mean(np.std(img_np, axis=(0, 1)))
+    gx = np.abs(np.diff(gray, axis=1))
+    gy = np.abs(np.diff(gray, axis=0))
+    edge_strength = np.mean(gx) + np.mean(gy)
+
+    if mean_color_std < 15:
+        raise ValueError("Gambar bukan citra kulit kepala yang valid")
+    if brightness < 40:
+        raise ValueError("Gambar terlalu gelap dan tidak terdeteksi sebagai kulit kepala")
+    if contrast < 18:
+        raise ValueError("Gambar terlalu polos dan bukan citra kulit kepala")
+    if edge_strength < 12:
+        raise ValueError("Gambar Tidak ditemukan tekstur rambut")
+    if np.var(np.diff(gray, 2)) < 15:
+        raise ValueError("Gambar terlalu halus / blur")
+
+    r = img_np[:, :, 0]
+    g = img_np[:, :, 1]
+    b = img_np[:, :, 2]
+    skin_mask = (r > 95) & (g > 40) & (b > 20) & \
+                ((np.max(img_np, axis=2) - np.min(img_np, axis=2)) > 15) & \
+                (np.abs(r - g) > 15) & (r > g) & (r > b)
+    if np.sum(skin_mask) / skin_mask.size < 0.10:
+        raise ValueError("Gambar tidak terdeteksi warna kulit kepala")
+
+
+def legacy_pipeline(image_bytes):
+    legacy_gate(Image.open(io.BytesIO(image_bytes)).convert("RGB"))
+
+
+def new_pipeline(image_bytes):
+    check_quality(decode_image(image_bytes)[0])
+
+
+def _decide(pipeline, image_bytes):
+    started = time.perf_counter()
+    try:
+        pipeline(image_bytes)
+        result = "accept"
+    except ValueError as e:
+        result = f"reject: {e}"
+    return result, time.perf_counter() - started
+
+
+def corpus(image_dir):
+    """Yield ``(name, image bytes)`` for the stored uploads, then the synthetic phone photos."""
+    for path in stored_uploads(image_dir):
+        with open(path, "rb") as f:
+            yield os.path.relpath(path, image_dir), f.read()
+    for seed, (width, height) in enumerate(PHONE_RESOLUTIONS):
+        yield f"synthetic-{width}x{height}", synthetic_scalp(width, height, seed=seed, native=True)
+
+
+def main(image_dir="static/uploads"):
+    count = mismatches = 0
+    legacy_total = new_total = 0.0
+
+    for name, image_bytes in corpus(image_dir):
+        count += 1
+        old, old_t = _decide(legacy_pipeline, image_bytes)
+        new, new_t = _decide(new_pipeline, image_bytes)
+        legacy_total += old_t
+        new_total += new_t
+
+        same = old.split(":")[0] == new.split(":")[0]
+        mismatches += not same
+        flag = "ok" if same else "MISMATCH"
+        print(f"{flag:8} {name} legacy={old!r} new={new!r}")
+
+    print(
+        f"\n{count} images, {mismatches} mismatches, "
+        f"legacy {legacy_total * 1000:.1f} ms, new {new_total * 1000:.1f} ms"
+    )
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
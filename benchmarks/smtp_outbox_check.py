@@ -0,0 +1,161 @@
+"""Drive the email outbox against a local stand-in SMTP server.
+
+    python -m benchmarks.smtp_outbox_check
+
+Needs aiosmtpd (``pip install aiosmtpd``). Runs with a throwaway SQLite
+database and a server on 127.0.0.1 that misbehaves on purpose:
+
+- it drops the session after every few messages, which the sender has
+  to notice and reconnect on, without losing or repeating a message;
+- it answers 451 to the first DATA for one recipient, which has to be
+  retried after the backoff;
+- it always answers 451 for another, which has to end up ``failed``
+  after the maximum number of attempts;
+- it refuses one recipient with 550, which fails on the first attempt.
+
+Exits non-zero if any check fails.
+"""
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+
+DROP_EVERY = 5
+FLAKY_FAILURES = 2
+MAX_ATTEMPTS = 3
+BACKOFF = 0.2
+
+
+class StandinHandler:
+    def __init__(self):
+        self.accepted = []
+        self.sessions = 0
+        self.data_attempts = {}
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("nobody@"):
+            return "550 5.1.1 no such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        (rcpt,) = envelope.rcpt_tos
+        attempts = self.data_attempts.setdefault(rcpt, [])
+        attempts.append(time.monotonic())
+        flaky = rcpt.startswith("flaky@") and len(attempts) <= FLAKY_FAILURES
+        if flaky or rcpt.startswith("down@"):
+            return "451 4.3.0 try again later"
+        self.accepted.append(rcpt)
+        if len(self.accepted) % DROP_EVERY == 0:
+            # hang up once the reply is out, like a provider ending a long session
+            asyncio.get_running_loop().call_soon(server.transport.close)
+        return "250 OK"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _drain(sender, deadline: float):
+    from app.database import SessionLocal
+    from app.models import EmailOutbox
+
+    while time.monotonic() < deadline:
+        sender.send_due()
+        db = SessionLocal()
+        try:
+            if not db.query(EmailOutbox).filter(EmailOutbox.status == "pending").count():
+                return
+        finally:
+            db.close()
+        time.sleep(0.05)
+
+
+def run() -> int:
+    from aiosmtpd.controller import Controller
+
+    from app.database import SessionLocal
+    from app.models import EmailOutbox
+    from app.utils import email
+
+    handler = StandinHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    try:
+        connection = email.SMTPConnection(
+            host="127.0.0.1", port=controller.port, username="", password="",
+            starttls=False, timeout=5,
+        )
+        sender = email.OutboxSender(connection=connection, batch_size=10, max_attempts=MAX_ATTEMPTS)
+
+        bulk = [f"user{i}@example.com" for i in range(3 * DROP_EVERY)]
+        db = SessionLocal()
+        for address in bulk + ["flaky@example.com", "down@example.com", "nobody@example.com"]:
+            email.queue_reset_email(db, address, "123456")
+        db.commit()
+
+        connects = email.SMTP_CONNECTS.value()
+        started = time.monotonic()
+        _drain(sender, started + 30)
+        elapsed = time.monotonic() - started
+        connection.close()
+
+        rows = {row.to_email: row for row in db.query(EmailOutbox)}
+        db.close()
+    finally:
+        controller.stop()
+
+    flaky = handler.data_attempts.get("flaky@example.com", [])
+    gaps = [b - a for a, b in zip(flaky, flaky[1:])]
+    expected_gaps = [email._backoff(n) for n in range(1, len(flaky))]
+    checks = [
+        ("every bulk message sent once",
+         sorted(a for a in handler.accepted if a in bulk) == sorted(bulk)
+         and all(rows[a].status == "sent" for a in bulk)),
+        ("reconnected after dropped sessions",
+         email.SMTP_CONNECTS.value() - connects >= len(bulk) // DROP_EVERY),
+        ("transient failure retried, then sent",
+         rows["flaky@example.com"].status == "sent"
+         and rows["flaky@example.com"].attempts == FLAKY_FAILURES + 1),
+        ("retries waited for the backoff",
+         len(gaps) == FLAKY_FAILURES and all(g >= e * 0.9 for g, e in zip(gaps, expected_gaps))),
+        ("gave up after max attempts",
+         rows["down@example.com"].status == "failed"
+         and rows["down@example.com"].attempts == MAX_ATTEMPTS),
+        ("refused recipient failed at once",
+         rows["nobody@example.com"].status == "failed"
+         and rows["nobody@example.com"].attempts == 1),
+    ]
+
+    failures = 0
+    for name, ok in checks:
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':5} {name}")
+    print(
+        f"\n{len(rows)} messages, {handler.sessions} SMTP sessions, "
+        f"retry gaps {', '.join(f'{g:.2f}s' for g in gaps) or '-'}, drained in {elapsed:.1f}s"
+    )
+    return 1 if failures else 0
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'outbox.db')}"
+        os.environ["EMAIL_OUTBOX_SENDER"] = "0"
+        os.environ["EMAIL_OUTBOX_BACKOFF"] = str(BACKOFF)
+        from app.migrations import run_migrations
+        run_migrations()
+        return run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Worker cold start: import time, RSS, time to /ready and first-request latency.
+
+    python -m benchmarks.startup_bench [image_dir]
+
+Each configuration runs in a fresh interpreter process. The prediction
+cache is disabled so every request reaches the model; the first and second
+/predict/ calls use different images.
+"""
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+CONFIGS = [
+    ("auto runtime, warmup", {"TFLITE_RUNTIME": "auto"}),
+    ("auto runtime, no warmup", {"TFLITE_RUNTIME": "auto", "MODEL_WARMUP_RUNS": "0"}),
+    ("tensorflow, warmup", {"TFLITE_RUNTIME": "tensorflow"}),
+]
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _child(image_dir):
+    import asyncio
+
+    started = time.perf_counter()
+    import app.main  # noqa: F401
+    import_s = time.perf_counter() - started
+    import_rss = _rss_mb()
+
+    import httpx
+    from app.main import app
+
+    paths = [
+        p for p in sorted(glob.glob(os.path.join(image_dir, "**", "*.jpg"), recursive=True))
+        if "_thumb" not in p
+    ][:2]
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                t = time.perf_counter()
+                while (await client.get("/ready")).status_code != 200:
+                    await asyncio.sleep(0.01)
+                ready_s = time.perf_counter() - t
+
+                latencies = []
+                for path in paths:
+                    with open(path, "rb") as f:
+                        files = {"file": (os.path.basename(path), f.read(), "image/jpeg")}
+                    t = time.perf_counter()
+                    response = await client.post("/predict/", files=files)
+                    latencies.append((time.perf_counter() - t) * 1000)
+                    assert response.status_code == 200, response.text
+                return ready_s, latencies
+
+    ready_s, latencies = asyncio.run(run())
+    from app.ml import hair_classification
+    print(json.dumps({
+        "runtime": hair_classification.runtime,
+        "import_s": import_s,
+        "import_rss_mb": import_rss,
+        "ready_s": ready_s,
+        "ready_rss_mb": _rss_mb(),
+        "first_ms": latencies[0] if latencies else None,
+        "second_ms": latencies[1] if len(latencies) > 1 else None,
+    }))
+
+
+def main(image_dir="static/uploads"):
+    print(f"{'config':26} {'runtime':15} {'import s':>9} {'import MB':>10} "
+          f"{'ready s':>8} {'ready MB':>9} {'1st ms':>8} {'2nd ms':>8}")
+    for name, env in CONFIGS:
+        child_env = {**os.environ, "PREDICTION_CACHE_PATH": "", "PREDICTION_CACHE_SIZE": "0",
+                     "EMAIL_OUTBOX_SENDER": "0", **env}
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup_bench", "--child", image_dir],
+            env=child_env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{name:26} failed: {proc.stderr.strip().splitlines()[-1:]}")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        fmt = lambda v: f"{v:8.1f}" if v is not None else f"{'-':>8}"
+        print(f"{name:26} {r['runtime']:15} {r['import_s']:9.2f} {r['import_rss_mb']:10.0f} "
+              f"{r['ready_s']:8.2f} {r['ready_rss_mb']:9.0f} {fmt(r['first_ms'])} {fmt(r['second_ms'])}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        _child(*sys.argv[2:])
+    else:
+        main(*sys.argv[1:])
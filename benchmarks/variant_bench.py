@@ -0,0 +1,131 @@
+"""Latency, throughput, memory and top-1 agreement of each model variant.
+
+    python -m benchmarks.variant_bench <labelled_dir> [--threads N] [--no-xnnpack]
+                                       [--model-dir DIR] [--runs N]
+
+``labelled_dir`` holds one sub-folder per label (``ketombe/``, ``normal/``,
+...). Every variant found in the model directory runs in a fresh process on
+the same images at batch size 1. Agreement is measured against fp32; accuracy
+against the folder names when they match the model's labels.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def labelled_images(root):
+    items = []
+    for path in sorted(glob.glob(os.path.join(root, "*", "*"))):
+        if os.path.splitext(path)[1].lower() in EXTENSIONS:
+            items.append((path, os.path.basename(os.path.dirname(path))))
+    return items
+
+
+def _child(args):
+    from app.ml.decode import decode_image
+    from app.ml.hair_classification import labels, load_interpreter, normalize, warm_up
+    from app.ml.registry import get_variant
+
+    base_rss = _rss_mb()
+    variant = get_variant(args.variant, args.model_dir)
+    interp = load_interpreter(variant.path, args.threads, not args.no_xnnpack)
+    warm_up(interp)
+    variant.inspect(interp)
+    inp = interp.get_input_details()[0]
+    out = interp.get_output_details()[0]
+
+    inputs = []
+    for path, _ in labelled_images(args.images):
+        with open(path, "rb") as f:
+            img, _ = decode_image(f.read())
+        inputs.append(variant.quantize(normalize(img)))
+
+    latencies, predictions = [], []
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        predictions = []
+        for x in inputs:
+            t = time.perf_counter()
+            interp.set_tensor(inp["index"], x)
+            interp.invoke()
+            probs = variant.dequantize(interp.get_tensor(out["index"])[0])
+            latencies.append((time.perf_counter() - t) * 1000)
+            predictions.append(labels[int(np.argmax(probs))])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "variant": variant.metadata(),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "images_per_s": len(latencies) / elapsed,
+        "rss_mb": _rss_mb() - base_rss,
+        "predictions": predictions,
+    }))
+
+
+def main(args):
+    from app.ml.registry import available_variants
+
+    images = labelled_images(args.images)
+    if not images:
+        sys.exit(f"no labelled images under {args.images}/<label>/")
+    truth = [label for _, label in images]
+
+    variants = sorted(available_variants(args.model_dir), key=lambda n: n != "fp32")
+    results = {}
+    for name in variants:
+        cmd = [sys.executable, "-m", "benchmarks.variant_bench", args.images, "--child",
+               "--variant", name, "--model-dir", args.model_dir,
+               "--threads", str(args.threads), "--runs", str(args.runs)]
+        if args.no_xnnpack:
+            cmd.append("--no-xnnpack")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{name}: failed: {proc.stderr.strip().splitlines()[-1:]}", file=sys.stderr)
+            continue
+        results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    reference = results.get("fp32", {}).get("predictions")
+    print(f"{len(images)} images, {args.threads} thread(s), "
+          f"xnnpack {'off' if args.no_xnnpack else 'on'}")
+    print(f"{'variant':9} {'MB':>7} {'input':>6} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'img/s':>8} {'RSS MB':>7} {'agree':>7} {'acc':>7}")
+    for name, r in results.items():
+        preds = r["predictions"]
+        agree = (np.mean([a == b for a, b in zip(preds, reference)])
+                 if reference else float("nan"))
+        acc = np.mean([p == t for p, t in zip(preds, truth)])
+        meta = r["variant"]
+        print(f"{name:9} {meta['size_bytes'] / 1e6:7.1f} {meta['input_dtype']:>6} "
+              f"{r['p50_ms']:8.2f} {r['p99_ms']:8.2f} {r['images_per_s']:8.1f} "
+              f"{r['rss_mb']:7.0f} {agree:7.1%} {acc:7.1%}")
+
+
+if __name__ == "__main__":
+    from app.ml.hair_classification import INTERPRETER_THREADS
+    from app.ml.registry import MODEL_DIR
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--threads", type=int, default=INTERPRETER_THREADS)
+    parser.add_argument("--no-xnnpack", action="store_true")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    _child(args) if args.child else main(args)